@@ -3,197 +3,1197 @@ Unified AI Service: LLM and Embeddings.
 Handles local GGUF models (llama-cpp-python) and remote OpenAI-compatible APIs.
 """
 
+import asyncio
+import email.utils
+import hashlib
 import logging
 import os
-import requests
+import queue
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Iterator
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from types import SimpleNamespace
+
+import httpx
+import numpy as np
+import orjson
 
 # Suppress Metal/GGML logging
 os.environ.setdefault("GGML_LOG_LEVEL", "4")
 
+# Loading libllama takes a few hundred ms; pay it at import rather than inside
+# init_*, and not at all when both services are remote.
+if "local" in (os.getenv("LLM_MODE", "local"), os.getenv("EMBED_MODE", "local")):
+    try:
+        import llama_cpp  # noqa: F401
+    except ImportError:
+        pass
+
 logger = logging.getLogger(__name__)
 
 # ── Shared State ─────────────────────────────────────────────────────────────
-_llm_model = None
-_embed_model = None
-_llm_mode = None
-_embed_mode = None
+_llm_pool: queue.Queue | None = None  # idle local LLM replicas
+_llm_slots: asyncio.Semaphore | None = None  # async callers admitted to the LLM backend
+_embed_pool: queue.Queue | None = None  # idle local embedding replicas
+_embed_replicas = 0  # local embedding replicas loaded (the pool's full size)
+_embed_model_id = ""  # identifies the loaded embedder in cache keys
+_llm_model_id = ""  # identifies the loaded LLM in cache keys
+_semantic_cache = None  # SemanticCache when LLM_SEMANTIC_CACHE=1
 
 
-# ── LLM Logic ────────────────────────────────────────────────────────────────
+@lru_cache(maxsize=1)
+def _config() -> SimpleNamespace:
+    """Environment settings, read once; init_llm/init_embeddings re-read them."""
+    def headers(api_key: str) -> dict:
+        h = {"Content-Type": "application/json"}
+        if api_key:
+            h["Authorization"] = f"Bearer {api_key}"
+        return h
+
+    llm_url = os.getenv("LLM_API_URL", "")
+    embed_url = os.getenv("EMBED_API_URL", "")
+    return SimpleNamespace(
+        llm_mode=os.getenv("LLM_MODE", "local"),
+        llm_api_url=llm_url,
+        llm_chat_url=f"{llm_url.rstrip('/')}/chat/completions",
+        llm_headers=headers(os.getenv("LLM_API_KEY", "")),
+        llm_model_name=os.getenv("LLM_MODEL_NAME"),
+        llm_max_ctx=int(os.getenv("LLM_MAX_CTX", "0")),  # 0 = no client-side check
+        llm_cache_ttl=float(os.getenv("LLM_CACHE_TTL", "1800")),  # 0 = no completion cache
+        llm_cache_prompt=os.getenv("LLM_CACHE_PROMPT", "0") == "1",
+        embed_mode=os.getenv("EMBED_MODE", "local"),
+        embed_api_url=embed_url,
+        embed_url=f"{embed_url.rstrip('/')}/embeddings",
+        embed_headers=headers(os.getenv("EMBED_API_KEY", "")),
+        embed_model_name=os.getenv("EMBED_MODEL_NAME"),
+        embed_cache_dir=os.path.expanduser(os.getenv("EMBED_CACHE_DIR", "")),
+        embed_cache_max_bytes=int(float(os.getenv("EMBED_CACHE_MAX_MB", "256")) * 2**20),  # 0 = unbounded
+    )
+
+
+class LRUCache:
+    """Small bounded mapping that evicts the least recently used entry."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Embeddings are deterministic per (model, input), so repeated queries and
+# re-added clipboard items skip the model entirely. Entries are keyed by a
+# digest of both, so switching models never serves stale vectors. Cached
+# vectors are shared between callers, so they are stored read-only.
+_embed_cache = LRUCache(1024)
+
+def clear_embedding_cache():
+    """Drop the in-memory embedding cache (the on-disk one is left alone)."""
+    _embed_cache.clear()
+
+def _embed_key(text: str) -> bytes:
+    return hashlib.blake2b(f"{_embed_model_id}\0{text}".encode(), digest_size=16).digest()
+
+def _cache_path(key: bytes) -> str | None:
+    cache_dir = _config().embed_cache_dir
+    return os.path.join(cache_dir, key.hex()) if cache_dir else None
+
+def _cache_get(key: bytes):
+    vec = _embed_cache.get(key)
+    if vec is None and (path := _cache_path(key)):
+        try:
+            with open(path, "rb") as f:
+                vec = np.frombuffer(f.read(), dtype=np.float32)  # read-only view
+        except OSError:
+            return None
+        _embed_cache.put(key, vec)
+        try:
+            os.utime(path)  # mtime doubles as last use for pruning
+        except OSError:
+            pass
+    return vec
+
+def _cache_put(key: bytes, vec):
+    _embed_cache.put(key, vec)
+    if path := _cache_path(key):
+        # Optional persistent tier: one raw float32 file per digest, so the
+        # cache survives restarts. Written atomically through a uniquely named
+        # temp file, so concurrent writers (threads or workers) never share
+        # one; failures only cost a miss.
+        cache_dir = os.path.dirname(path)
+        tmp = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=cache_dir, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(vec.tobytes())
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.debug("Embedding cache write failed: %s", e)
+            if tmp is not None:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+            return
+        _disk_cache_grew(cache_dir, vec.nbytes)
+
+# Size bookkeeping for the disk tier. Each process keeps a running estimate
+# and, once it passes EMBED_CACHE_MAX_MB, prunes the least recently used
+# files (by mtime) down to 80% of the cap on a background thread.
+_disk_cache_lock = threading.Lock()
+_disk_cache_bytes: int | None = None  # unknown until the first scan
+_disk_cache_pruning = False
+
+def _disk_cache_grew(cache_dir: str, size: int):
+    global _disk_cache_bytes, _disk_cache_pruning
+    max_bytes = _config().embed_cache_max_bytes
+    if not max_bytes:
+        return
+    with _disk_cache_lock:
+        if _disk_cache_bytes is not None:
+            _disk_cache_bytes += size
+            if _disk_cache_bytes <= max_bytes:
+                return
+        if _disk_cache_pruning:
+            return
+        _disk_cache_pruning = True
+    threading.Thread(target=_prune_disk_cache, args=(cache_dir, max_bytes), daemon=True).start()
+
+def _prune_disk_cache(cache_dir: str, max_bytes: int):
+    global _disk_cache_bytes, _disk_cache_pruning
+    try:
+        entries = []
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if total > max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= max_bytes * 0.8:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                total -= size
+        with _disk_cache_lock:
+            _disk_cache_bytes = total
+    except OSError as e:
+        logger.debug("Embedding cache prune failed: %s", e)
+    finally:
+        _disk_cache_pruning = False
+
+# Keep-alive session for the synchronous remote paths: one TCP/TLS handshake
+# per host instead of per call, with a few retries on transient failures.
+# Built (and `requests` imported) on first use, so local mode never loads it.
+@lru_cache(maxsize=1)
+def _session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=64,
+        # POST is retried too: completions and embeddings have no side effects.
+        # Retry-After (429/503) is honoured over the exponential backoff.
+        # Read timeouts are not retried: the server may still be generating,
+        # and five more 60s waits would only stack duplicate work on it.
+        max_retries=Retry(
+            total=5,
+            read=0,
+            backoff_factor=0.25,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"],
+            respect_retry_after_header=True,
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Pooled keep-alive client for the async remote paths, created on first use so
+# it binds to the running event loop.
+_http: httpx.AsyncClient | None = None
+
+def _get_http() -> httpx.AsyncClient:
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                retries=3,  # connection failures only
+            ),
+            timeout=60,
+        )
+    return _http
+
+# Status retries for the async paths, mirroring the sync session's Retry:
+# the transport's own retries only cover failed connections.
+_RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+_RETRY_ATTEMPTS = 5
+_RETRY_BACKOFF = 0.25
+_RETRY_AFTER_MAX = 60.0
+
+def _retry_delay(r: httpx.Response, attempt: int) -> float:
+    """Seconds to wait before retrying r: its Retry-After if present, else exponential backoff."""
+    value = r.headers.get("Retry-After", "").strip()
+    if value:
+        try:
+            return min(max(float(value), 0.0), _RETRY_AFTER_MAX)
+        except ValueError:
+            try:
+                when = email.utils.parsedate_to_datetime(value).timestamp()
+                return min(max(when - time.time(), 0.0), _RETRY_AFTER_MAX)
+            except (TypeError, ValueError):
+                pass
+    return _RETRY_BACKOFF * 2 ** attempt
+
+async def _apost(url: str, headers: dict, body: bytes, *, stream: bool = False,
+                 timeout=httpx.USE_CLIENT_DEFAULT) -> httpx.Response:
+    """POST on the shared async client, retrying 429/5xx responses.
 
-def _get_llm_mode():
-    return os.getenv("LLM_MODE", "local")
+    Read timeouts are not retried (see _session). With stream=True the
+    caller owns the returned response and must aclose() it.
+    """
+    client = _get_http()
+    for attempt in range(_RETRY_ATTEMPTS + 1):
+        request = client.build_request("POST", url, headers=headers, content=body, timeout=timeout)
+        r = await client.send(request, stream=stream)
+        if r.status_code not in _RETRY_STATUS or attempt == _RETRY_ATTEMPTS:
+            return r
+        await r.aclose()
+        await asyncio.sleep(_retry_delay(r, attempt))
+
+async def close_http():
+    """Close the pooled remote-API client (call on shutdown)."""
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+def _is_outage(exc: BaseException) -> bool:
+    """Whether exc says the endpoint is down or overloaded, not that the request was bad.
+
+    Connection errors, timeouts, 429 and 5xx count; 4xx and parse errors do not.
+    """
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    if isinstance(exc, httpx.TransportError):
+        return True
+    # requests is only imported once a sync remote call has needed it.
+    requests = sys.modules.get("requests")
+    if requests is not None:
+        if isinstance(exc, requests.HTTPError):
+            return exc.response is not None and (exc.response.status_code == 429 or exc.response.status_code >= 500)
+        # RetryError: the session's own 429/5xx retries ran out.
+        return isinstance(exc, (requests.ConnectionError, requests.Timeout, requests.exceptions.RetryError))
+    return False
+
+
+class _CircuitBreaker:
+    """Fail fast once a remote endpoint keeps failing.
+
+    Used as a context manager around a call: after fail_max consecutive
+    outage errors (see _is_outage), calls raise CircuitOpenError for
+    reset_timeout seconds instead of queueing more doomed requests, then go
+    through again as a probe. Rejected requests (4xx), cancellation and
+    generator close do not count as failures.
+    """
+
+    def __init__(self, name: str, fail_max: int = 10, reset_timeout: float = 30):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = 0.0
+
+    def __enter__(self):
+        if self._failures >= self.fail_max:
+            wait = self.reset_timeout - (time.monotonic() - self._opened_at)
+            if wait > 0:
+                raise CircuitOpenError(f"{self.name} unavailable after {self._failures} failures; retrying in {wait:.0f}s")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._failures = 0
+        elif _is_outage(exc):
+            self._failures += 1
+            if self._failures >= self.fail_max:
+                self._opened_at = time.monotonic()
+        return False
+
+
+_llm_breaker = _CircuitBreaker("Remote LLM API")
+_embed_breaker = _CircuitBreaker("Remote embedding API")
+
+
+# ── llama.cpp Settings ───────────────────────────────────────────────────────
+
+def _llama_kwargs(share: int = 1, mlock_var: str = "LLAMA_USE_MLOCK", mlock_default: str = "1") -> dict:
+    """Threading, memory and offload settings shared by every local Llama.
+
+    share: number of instances that will run concurrently and split the cores.
+    mlock_var/mlock_default: env switch deciding whether weights are locked.
+    """
+    # Past ~16 threads llama.cpp is memory-bandwidth bound and extra threads
+    # only add sync overhead.
+    total = int(os.getenv("LLAMA_N_THREADS") or min(os.cpu_count() or 8, 16))
+    n_threads = max(1, total // share)
+    return {
+        "n_threads": n_threads,
+        "n_threads_batch": n_threads,
+        "use_mmap": True,
+        # Keep weights resident (no page-outs under memory pressure); turn it
+        # off on hosts without RAM to spare for locked pages.
+        "use_mlock": os.getenv(mlock_var, mlock_default) == "1",
+        "n_gpu_layers": int(os.getenv("LLAMA_N_GPU_LAYERS", "-1")),  # -1 = all layers on Metal/CUDA
+        "offload_kqv": True,  # KV cache lives on the GPU with the layers
+        "flash_attn": True,
+    }
+
+
+def _load_llama(**kwargs):
+    """Construct a Llama, retrying on CPU if the GPU/flash-attention setup fails."""
+    from llama_cpp import Llama
+
+    try:
+        return Llama(**kwargs)
+    except (ValueError, RuntimeError) as e:
+        if not kwargs.get("n_gpu_layers") and not kwargs.get("flash_attn"):
+            raise
+        logger.warning("GPU load failed (%s); falling back to CPU.", e)
+        return Llama(**{**kwargs, "n_gpu_layers": 0, "offload_kqv": False, "flash_attn": False})
+
+
+def _warm_up(model, embedding: bool = False):
+    """Run one tiny request so Metal/CUDA graphs and compute buffers are
+    allocated at startup instead of on the first user request."""
+    try:
+        if embedding:
+            model.embed("warmup")
+        else:
+            model.create_chat_completion(messages=[{"role": "user", "content": "hi"}], max_tokens=1)
+    except Exception as e:
+        logger.warning("Model warm-up failed: %s", e)
+
+
+_F_RDADVISE = 44  # <sys/fcntl.h> on Darwin; not exported by the fcntl module
+_RDADVISE_CHUNK = 1 << 30  # struct radvisory's ra_count is a C int
+
+def _readahead(path: str):
+    """Queue kernel readahead for a file and return immediately.
+
+    posix_fadvise on Linux; fcntl(F_RDADVISE) on macOS, which has no
+    posix_fadvise. Elsewhere this is a no-op.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        elif sys.platform == "darwin":
+            import fcntl
+            import struct
+
+            size = os.fstat(fd).st_size
+            for offset in range(0, size, _RDADVISE_CHUNK):
+                count = min(_RDADVISE_CHUNK, size - offset)
+                fcntl.fcntl(fd, _F_RDADVISE, struct.pack("qi", offset, count))
+    finally:
+        os.close(fd)
+
+
+def prefetch_models(embed_paths: list[str], llm_paths: list[str]):
+    """Start paging in the GGUFs init_embeddings/init_llm will load.
+
+    Models load one after another; hinting both files up front lets the LLM
+    weights stream in from disk while the embedder is still initialising.
+    """
+    cfg = _config()
+    for mode, paths in ((cfg.embed_mode, embed_paths), (cfg.llm_mode, llm_paths)):
+        if mode != "local":
+            continue
+        path = next((p for p in paths if os.path.exists(p)), None)
+        if path:
+            try:
+                _readahead(path)
+            except OSError as e:
+                logger.debug("readahead of %s failed: %s", path, e)
+
+
+# ── LLM Logic ────────────────────────────────────────────────────────────────
 
 def init_llm(model_paths: list[tuple[str, str]] | None = None):
     """
     Initialize the LLM backend.
+
+    llama.cpp contexts are not re-entrant, so each concurrent completion needs
+    its own instance: LLM_REPLICAS (default 1) are loaded into a pool. The
+    weights are mmap'd and shared; each extra replica costs its KV cache and
+    compute buffers (~100-300 MB at the default LLAMA_N_CTX=4096).
     """
-    global _llm_model, _llm_mode
-    _llm_mode = _get_llm_mode()
+    global _llm_pool, _llm_slots, _llm_model_id, _semantic_cache
+    _config.cache_clear()
+    cfg = _config()
+    _llm_cache.clear()
+    _semantic_cache = None
+    if os.getenv("LLM_SEMANTIC_CACHE", "0") == "1":
+        _semantic_cache = SemanticCache(float(os.getenv("LLM_SEMANTIC_CACHE_THRESHOLD", "0.95")))
 
-    if _llm_mode == "remote":
-        logger.info("LLM mode: remote (%s)", os.getenv("LLM_API_URL", "not set"))
+    if cfg.llm_mode == "remote":
+        logger.info("LLM mode: remote (%s)", cfg.llm_api_url or "not set")
+        # Keep in-flight requests at what the server will actually run in
+        # parallel (Ollama: OLLAMA_NUM_PARALLEL, vLLM: --max-num-seqs);
+        # anything beyond that only queues server-side.
+        concurrency = max(1, int(os.getenv("LLM_CLIENT_CONCURRENCY", "8")))
+        server = {k: v for k in ("OLLAMA_NUM_PARALLEL", "OLLAMA_MAX_LOADED_MODELS", "VLLM_MAX_NUM_SEQS") if (v := os.getenv(k))}
+        logger.info("LLM client concurrency: %d (server settings: %s)", concurrency, server or "not set")
+        _llm_pool, _llm_slots = None, asyncio.Semaphore(concurrency)
+        _llm_model_id = f"{cfg.llm_model_name or 'remote'}@{cfg.llm_api_url}"
         return
 
-    from llama_cpp import Llama
-
     if model_paths is None:
         model_paths = []
 
+    replicas = max(1, int(os.getenv("LLM_REPLICAS", "1")))
+    # Each replica already skips re-prefilling the prefix it shares with its
+    # previous prompt (the fixed system prompt). LLM_PROMPT_CACHE_MB adds a
+    # RAM cache of saved KV states, so prefixes survive across interleaved
+    # prompts too; one state can be hundreds of MB at full context.
+    cache_bytes = int(os.getenv("LLM_PROMPT_CACHE_MB", "0")) << 20
+    # Speculative decoding with drafts taken from the prompt itself: extraction
+    # answers mostly copy spans of their input, so several drafted tokens are
+    # verified per forward pass. No second model is needed.
+    lookup_tokens = int(os.getenv("LLM_PROMPT_LOOKUP", "0"))
     for path, name in model_paths:
         if os.path.exists(path):
-            logger.info("Loading %s LLM from %s...", name, path)
-            _llm_model = Llama(model_path=path, n_ctx=4096, n_batch=512, verbose=False)
+            logger.info("Loading %s LLM from %s (%d replicas)...", name, path, replicas)
+            pool = queue.Queue()
+            for _ in range(replicas):
+                draft = None
+                if lookup_tokens:
+                    from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+                    draft = LlamaPromptLookupDecoding(num_pred_tokens=lookup_tokens)
+                model = _load_llama(
+                    model_path=path,
+                    draft_model=draft,
+                    n_ctx=int(os.getenv("LLAMA_N_CTX", "4096")),
+                    n_batch=int(os.getenv("LLAMA_N_BATCH", "2048")),
+                    n_ubatch=int(os.getenv("LLAMA_N_UBATCH", "512")),
+                    verbose=False,
+                    **_llama_kwargs(share=replicas),
+                )
+                _warm_up(model)
+                if cache_bytes:
+                    from llama_cpp import LlamaRAMCache
+                    model.set_cache(LlamaRAMCache(capacity_bytes=cache_bytes))
+                pool.put(model)
+            _llm_pool, _llm_slots = pool, asyncio.Semaphore(replicas)
+            _llm_model_id = os.path.basename(path)
             logger.info("%s LLM loaded.", name)
             return
 
     logger.warning("No LLM model found. LLM features disabled.")
 
+# Identical completions recur (Cognee's cognify replays the same extraction
+# prompts over the same chunks), so answers are kept for LLM_CACHE_TTL seconds,
+# keyed by a digest of the model and inputs. Failures are never stored.
+_llm_cache = LRUCache(1024)
+_llm_cache_stats = {"hits": 0, "misses": 0}
+
+def clear_llm_cache():
+    _llm_cache.clear()
+    if _semantic_cache is not None:
+        _semantic_cache.clear()
+
+def llm_cache_stats() -> dict:
+    stats = {**_llm_cache_stats, "size": len(_llm_cache)}
+    if _semantic_cache is not None:
+        stats["semantic_hits"] = _semantic_cache.hits
+    return stats
+
+def _llm_cache_key(messages: list[dict], max_tokens: int) -> bytes:
+    h = hashlib.sha256()
+    for data in (_llm_model_id.encode(), str(max_tokens).encode(), orjson.dumps(messages)):
+        h.update(len(data).to_bytes(8, "little"))  # length-prefixed: no separator collisions
+        h.update(data)
+    return h.digest()
+
+def _llm_cache_get(key: bytes) -> str | None:
+    if _config().llm_cache_ttl <= 0:
+        return None
+    entry = _llm_cache.get(key)
+    if entry is not None and entry[1] > time.monotonic():
+        _llm_cache_stats["hits"] += 1
+        return entry[0]
+    _llm_cache_stats["misses"] += 1
+    return None
+
+def _llm_cache_put(key: bytes, text: str):
+    if _config().llm_cache_ttl > 0 and not is_llm_error(text):
+        _llm_cache.put(key, (text, time.monotonic() + _config().llm_cache_ttl))
+
+class SemanticCache:
+    """Answers for near-duplicate prompts, matched by embedding similarity.
+
+    Paraphrased prompts miss the exact-match cache. Each (model, system
+    prompt, max_tokens) namespace keeps a ring of unit-normalised user-prompt
+    embeddings; a lookup is one matrix-vector product against it.
+    """
+
+    def __init__(self, threshold: float, per_namespace: int = 256):
+        self.threshold = threshold
+        self.per_namespace = per_namespace
+        self._rings = LRUCache(64)  # namespace -> [vectors, answers, next slot]
+        self.hits = 0
+
+    @staticmethod
+    def namespace(messages: list[dict], max_tokens: int) -> bytes:
+        system = "\0".join(m["content"] for m in messages if m["role"] == "system")
+        return hashlib.blake2b(f"{_llm_model_id}\0{max_tokens}\0{system}".encode(), digest_size=16).digest()
+
+    def get(self, namespace: bytes, vec: np.ndarray) -> str | None:
+        ring = self._rings.get(namespace)
+        if ring is None:
+            return None
+        vectors, answers, _ = ring
+        scores = vectors[:len(answers)] @ (vec / np.linalg.norm(vec))
+        best = int(scores.argmax())
+        if scores[best] < self.threshold:
+            return None
+        self.hits += 1
+        return answers[best]
+
+    def put(self, namespace: bytes, vec: np.ndarray, answer: str):
+        ring = self._rings.get(namespace)
+        if ring is None:
+            ring = [np.zeros((self.per_namespace, vec.shape[0]), dtype=np.float32), [], 0]
+            self._rings.put(namespace, ring)
+        vectors, answers, slot = ring
+        vectors[slot] = vec / np.linalg.norm(vec)
+        if slot < len(answers):
+            answers[slot] = answer
+        else:
+            answers.append(answer)
+        ring[2] = (slot + 1) % self.per_namespace
+
+    def clear(self):
+        self._rings.clear()
+
+
+async def _prompt_vector(messages: list[dict]) -> np.ndarray | None:
+    """Embed the non-system turns for SemanticCache, or None to bypass it.
+
+    Prompts skip the embedding caches: they are one-offs that would evict
+    item vectors from the LRU and land on disk via EMBED_CACHE_DIR. Prompts
+    longer than the embedder's context are not matched at all, since two
+    of them that differ only past the cut-off would embed identically.
+    """
+    text = "\n".join(m["content"] for m in messages if m["role"] != "system")
+    try:
+        if _config().embed_mode == "remote":
+            # ~4 chars per token, as for LLM_MAX_CTX
+            if len(text) // 4 > EMBED_N_CTX:
+                return None
+            return (await _remote_embed_async([text]))[0]
+        return await asyncio.to_thread(_local_embed_untruncated, text)
+    except Exception as e:
+        logger.debug("semantic cache skipped: %s", e)
+        return None
+
+def _chat_messages(system_prompt: str, user_prompt: str) -> list[dict]:
+    return [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
+
 def get_llm_response(system_prompt: str, user_prompt: str, max_tokens: int = 256) -> str:
     """Generate a chat completion."""
-    mode = _llm_mode or _get_llm_mode()
-    if mode == "remote":
-        return _remote_llm_completion(system_prompt, user_prompt, max_tokens)
-    return _local_llm_completion(system_prompt, user_prompt, max_tokens)
+    return get_chat_response(_chat_messages(system_prompt, user_prompt), max_tokens)
+
+async def get_llm_response_async(system_prompt: str, user_prompt: str, max_tokens: int = 256) -> str:
+    """Generate a chat completion without blocking the event loop."""
+    return await get_chat_response_async(_chat_messages(system_prompt, user_prompt), max_tokens)
+
+def get_chat_response(messages: list[dict], max_tokens: int = 256) -> str:
+    """Complete an OpenAI-style message list as given.
+
+    Passing the turns through (rather than flattening them into one prompt)
+    keeps the system prompt and earlier turns a byte-identical prefix between
+    calls, so llama.cpp reuses their KV cache and only prefills the new turn.
+    """
+    key = _llm_cache_key(messages, max_tokens)
+    text = _llm_cache_get(key)
+    if text is not None:
+        return text
+    if _config().llm_mode == "remote":
+        text = _remote_llm_completion(messages, max_tokens)
+    else:
+        text = _local_llm_completion(messages, max_tokens)
+    _llm_cache_put(key, text)
+    return text
+
+# Completions currently being generated, by cache key. Identical concurrent
+# requests (parallel cognify workers on the same chunk) await the first one's
+# task instead of generating again before the cache is populated.
+_llm_inflight: dict[bytes, asyncio.Task] = {}
+
+async def get_chat_response_async(messages: list[dict], max_tokens: int = 256) -> str:
+    """get_chat_response without blocking the event loop."""
+    key = _llm_cache_key(messages, max_tokens)
+    text = _llm_cache_get(key)
+    if text is not None:
+        return text
+    task = _llm_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_generate_chat_async(messages, max_tokens, key))
+        _llm_inflight[key] = task
+        task.add_done_callback(lambda t: _llm_inflight.pop(key) if _llm_inflight.get(key) is t else None)
+    # Shielded: one caller disconnecting must not cancel the others' answer
+    return await asyncio.shield(task)
+
+async def _generate_chat_async(messages: list[dict], max_tokens: int, key: bytes) -> str:
+    semantic, vec = _semantic_cache, None
+    if semantic is not None and (vec := await _prompt_vector(messages)) is not None:
+        namespace = semantic.namespace(messages, max_tokens)
+        text = semantic.get(namespace, vec)
+        if text is not None:
+            return text
+    # Wait for a free slot here rather than parked in an executor thread
+    async with _llm_slots or nullcontext():
+        if _config().llm_mode == "remote":
+            text = await _remote_llm_completion_async(messages, max_tokens)
+        elif _llm_pool is None:
+            text = _local_llm_completion(messages, max_tokens)
+        else:
+            text = await asyncio.to_thread(_local_llm_completion, messages, max_tokens)
+    _llm_cache_put(key, text)
+    if vec is not None and not is_llm_error(text):
+        semantic.put(namespace, vec, text)
+    return text
+
+async def get_llm_responses_batch(prompts: list[tuple[str, str]], max_tokens: int = 256) -> list[str]:
+    """Run many (system_prompt, user_prompt) completions concurrently.
+
+    Remote requests overlap on the shared HTTP/2 client; local ones spread
+    over the replica pool and queue for a free instance.
+    """
+    return list(await asyncio.gather(*(get_llm_response_async(s, u, max_tokens) for s, u in prompts)))
 
-def _local_llm_completion(system_prompt: str, user_prompt: str, max_tokens: int) -> str:
-    if _llm_model is None:
+# Chat-template end markers. A list, not a tuple: llama-cpp-python silently
+# ignores stop values that are neither str nor list.
+_STOP = ["[/INST]", "[INST]", "</s>", "<|im_end|>", "<|endoftext|>"]
+
+# Repetition guard: cut the answer at a leaked [/INST] or a run of blank lines
+_STOP_RE = re.compile(r"\[/INST\]|\n\n\n")
+
+@contextmanager
+def _borrow_llm():
+    """Check a replica out of the pool for the duration of one completion."""
+    model = _llm_pool.get()
+    try:
+        yield model
+    finally:
+        _llm_pool.put(model)
+
+def _local_llm_completion(messages: list[dict], max_tokens: int) -> str:
+    if _llm_pool is None:
         return "No local LLM loaded."
     
-    response = _llm_model.create_chat_completion(
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        max_tokens=max_tokens,
-        temperature=0.3,
-        repeat_penalty=1.3,
-        stop=["[/INST]", "[INST]", "</s>", "<|im_end|>", "<|endoftext|>"],
-    )
+    with _borrow_llm() as model:
+        response = model.create_chat_completion(
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=0.3,
+            repeat_penalty=1.3,
+            stop=_STOP,
+        )
     text = response["choices"][0]["message"]["content"].strip()
-    # Guard against repetition
-    for marker in ["[/INST]", "\n\n\n"]:
-        if marker in text:
-            text = text[:text.index(marker)].strip()
-            break
+    if m := _STOP_RE.search(text):
+        text = text[:m.start()].strip()
     return text
 
-def _remote_llm_completion(system_prompt: str, user_prompt: str, max_tokens: int) -> str:
-    api_url = os.getenv("LLM_API_URL")
-    api_key = os.getenv("LLM_API_KEY", "")
-    model_name = os.getenv("LLM_MODEL_NAME", "distil-labs-slm")
+def stream_llm_response(system_prompt: str, user_prompt: str, max_tokens: int = 256) -> Iterator[str]:
+    """Generate a chat completion, yielding text pieces as they are decoded."""
+    return stream_chat_response(_chat_messages(system_prompt, user_prompt), max_tokens)
 
-    if not api_url:
-        return "LLM_API_URL not set."
+def stream_chat_response(messages: list[dict], max_tokens: int = 256) -> Iterator[str]:
+    """Stream the completion of an OpenAI-style message list."""
+    if _config().llm_mode == "remote":
+        yield from _remote_llm_stream(messages, max_tokens)
+        return
+    if _llm_pool is None:
+        yield _local_llm_completion(messages, max_tokens)
+        return
 
-    headers = {"Content-Type": "application/json"}
-    if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
+    with _borrow_llm() as model:
+        chunks = model.create_chat_completion(
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=0.3,
+            repeat_penalty=1.3,
+            stop=_STOP,
+            stream=True,
+        )
+        text = ""
+        for chunk in chunks:
+            piece = chunk["choices"][0]["delta"].get("content")
+            if not text and piece:
+                piece = piece.lstrip()
+            if not piece:
+                continue
+            start = max(0, len(text) - 6)  # a marker may straddle two pieces
+            text += piece
+            # Same repetition guard as _local_llm_completion, applied as we go
+            if m := _STOP_RE.search(text, start):
+                head = text[len(text) - len(piece):m.start()]
+                if head:
+                    yield head
+                return
+            yield piece
+
+def stream_llm_response_async(system_prompt: str, user_prompt: str, max_tokens: int = 256) -> AsyncIterator[str]:
+    """Async view of stream_llm_response; decoding runs in a worker thread."""
+    return stream_chat_response_async(_chat_messages(system_prompt, user_prompt), max_tokens)
+
+async def stream_chat_response_async(messages: list[dict], max_tokens: int = 256) -> AsyncIterator[str]:
+    """Async view of stream_chat_response; local decoding runs in a worker thread."""
+    if _config().llm_mode == "remote":
+        # Upstream SSE is read on the loop itself: no thread per stream
+        async with _llm_slots or nullcontext():
+            async for piece in _remote_llm_stream_async(messages, max_tokens):
+                yield piece
+        return
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    cancelled = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for piece in stream_chat_response(messages, max_tokens):
+                if cancelled.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, piece)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    async with _llm_slots or nullcontext():
+        producer = loop.run_in_executor(None, produce)
+        try:
+            while (item := await queue.get()) is not done:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            cancelled.set()  # client went away: stop decoding at the next token
+            await producer
+
+def _remote_llm_request(messages: list[dict], max_tokens: int) -> tuple[str, dict, dict] | str:
+    """Build (url, headers, payload) for a remote chat completion, or an in-band error string."""
+    cfg = _config()
+    if not cfg.llm_api_url:
+        return "LLM_API_URL not set."
+    # ~4 chars per token: reject prompts that clearly overflow LLM_MAX_CTX
+    # before paying for the upload and the server's queue.
+    budget = cfg.llm_max_ctx - max_tokens
+    if cfg.llm_max_ctx and (estimate := sum(len(m["content"]) for m in messages) // 4) > budget:
+        return f"Remote LLM error: prompt too long (~{estimate} tokens, {budget} available)"
 
     payload = {
-        "model": model_name,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
+        "model": cfg.llm_model_name or "distil-labs-slm",
+        "messages": messages,
         "max_tokens": max_tokens,
         "temperature": 0.3,
     }
+    if cfg.llm_cache_prompt:
+        # llama-server extension: keep the slot's KV cache and only prefill the
+        # suffix that differs from its previous prompt. Strict OpenAI-style
+        # servers reject unknown fields, hence opt-in.
+        payload["cache_prompt"] = True
+    return cfg.llm_chat_url, cfg.llm_headers, payload
+
+def _remote_llm_completion(messages: list[dict], max_tokens: int) -> str:
+    req = _remote_llm_request(messages, max_tokens)
+    if isinstance(req, str):
+        return req
+    url, headers, payload = req
 
     try:
-        r = requests.post(f"{api_url.rstrip('/')}/chat/completions", headers=headers, json=payload, timeout=60)
-        r.raise_for_status()
-        return r.json()["choices"][0]["message"]["content"]
+        with _llm_breaker:
+            r = _session().post(url, headers=headers, data=orjson.dumps(payload), timeout=60)
+            r.raise_for_status()
+            return orjson.loads(r.content)["choices"][0]["message"]["content"]
+    except Exception as e:
+        return f"Remote LLM error: {e}"
+
+def _remote_llm_stream(messages: list[dict], max_tokens: int) -> Iterator[str]:
+    """Stream a remote completion over SSE, yielding content deltas."""
+    req = _remote_llm_request(messages, max_tokens)
+    if isinstance(req, str):
+        yield req
+        return
+    url, headers, payload = req
+
+    started = False
+    try:
+        with _llm_breaker, _session().post(url, headers=headers, data=orjson.dumps({**payload, "stream": True}), timeout=60, stream=True) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                choices = orjson.loads(data).get("choices")
+                piece = choices and choices[0].get("delta", {}).get("content")
+                if piece:
+                    started = True
+                    yield piece
+    except Exception as e:
+        # Before any output the failure is reported in-band like the other
+        # remote paths; mid-answer it must not be mistaken for more text.
+        if started:
+            raise
+        yield f"Remote LLM error: {e}"
+
+async def _remote_llm_stream_async(messages: list[dict], max_tokens: int) -> AsyncIterator[str]:
+    """_remote_llm_stream over the shared async HTTP/2 client."""
+    req = _remote_llm_request(messages, max_tokens)
+    if isinstance(req, str):
+        yield req
+        return
+    url, headers, payload = req
+
+    started = False
+    try:
+        with _llm_breaker:
+            r = await _apost(url, headers, orjson.dumps({**payload, "stream": True}), stream=True)
+            try:
+                r.raise_for_status()
+                async for line in r.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = orjson.loads(data).get("choices")
+                    piece = choices and choices[0].get("delta", {}).get("content")
+                    if piece:
+                        started = True
+                        yield piece
+            finally:
+                await r.aclose()
+    except Exception as e:
+        if started:
+            raise
+        yield f"Remote LLM error: {e}"
+
+async def _remote_llm_completion_async(messages: list[dict], max_tokens: int) -> str:
+    req = _remote_llm_request(messages, max_tokens)
+    if isinstance(req, str):
+        return req
+    url, headers, payload = req
+
+    try:
+        with _llm_breaker:
+            r = await _apost(url, headers, orjson.dumps(payload))
+            r.raise_for_status()
+            return orjson.loads(r.content)["choices"][0]["message"]["content"]
     except Exception as e:
         return f"Remote LLM error: {e}"
 
+# Completions report failure in-band; callers that cache answers skip these.
+_LLM_ERROR_PREFIXES = ("No local LLM loaded.", "LLM_API_URL not set.", "Remote LLM error:")
+
+def is_llm_error(text: str) -> bool:
+    return text.startswith(_LLM_ERROR_PREFIXES)
+
 def is_llm_available() -> bool:
-    mode = _llm_mode or _get_llm_mode()
-    if mode == "remote":
-        return bool(os.getenv("LLM_API_URL"))
-    return _llm_model is not None
+    if _config().llm_mode == "remote":
+        return bool(_config().llm_api_url)
+    return _llm_pool is not None
 
 def get_llm_model_name() -> str:
-    mode = _llm_mode or _get_llm_mode()
-    if mode == "remote":
-        return os.getenv("LLM_MODEL_NAME", "remote")
-    if _llm_model is not None:
+    if _config().llm_mode == "remote":
+        return _config().llm_model_name or "remote"
+    if _llm_pool is not None:
         return "distil-labs-local"
     return "none"
 
 
 # ── Embedding Logic ──────────────────────────────────────────────────────────
 
-def _get_embed_mode():
-    return os.getenv("EMBED_MODE", "local")
+EMBED_N_CTX = 2048  # nomic-embed-text's trained context; longer inputs are truncated
+
+def init_embeddings(model_paths: list[str] | None = None):
+    """Initialize the embedding backend from the first GGUF in model_paths that exists.
 
-def init_embeddings(model_path: str | None = None):
-    """Initialize the embedding backend."""
-    global _embed_model, _embed_mode
-    _embed_mode = _get_embed_mode()
+    EMBED_REPLICAS (default 2) independent Llama instances are loaded so
+    concurrent batches embed in parallel; with mmap they share one copy of
+    the weights and each replica only adds its own context buffers.
+    """
+    global _embed_pool, _embed_replicas, _embed_model_id
+    _config.cache_clear()
+    cfg = _config()
 
-    if _embed_mode == "remote":
-        logger.info("Embedding mode: remote (%s)", os.getenv("EMBED_API_URL", "not set"))
+    if cfg.embed_mode == "remote":
+        logger.info("Embedding mode: remote (%s)", cfg.embed_api_url or "not set")
+        _embed_model_id = f"{cfg.embed_model_name or 'nomic-embed-text'}@{cfg.embed_api_url}"
         return
 
-    from llama_cpp import Llama
-    if model_path and os.path.exists(model_path):
-        logger.info("Loading nomic-embed-text model...")
-        _embed_model = Llama(
-            model_path=model_path,
-            embedding=True,
-            n_ctx=2048,
-            n_batch=512,
-            verbose=False,
-        )
-        logger.info("Embedding model loaded.")
-    else:
-        logger.warning("Embedding model not found at %s", model_path)
+    from llama_cpp import LLAMA_POOLING_TYPE_MEAN
+
+    replicas = max(1, int(os.getenv("EMBED_REPLICAS", "2")))
+    for path in model_paths or []:
+        if os.path.exists(path):
+            logger.info("Loading nomic-embed-text model from %s (%d replicas)...", path, replicas)
+            pool = queue.Queue()
+            for _ in range(replicas):
+                model = _load_llama(
+                    model_path=path,
+                    embedding=True,
+                    pooling_type=LLAMA_POOLING_TYPE_MEAN,  # one pooled vector per input
+                    n_ctx=EMBED_N_CTX,
+                    # Embedding models are non-causal: a whole input must fit in
+                    # one micro-batch, so size it to the context.
+                    n_batch=EMBED_N_CTX,
+                    n_ubatch=EMBED_N_CTX,
+                    verbose=False,
+                    # Not locked unless asked: the small embedder pages back in
+                    # quickly, and LLAMA_USE_MLOCK is meant for the LLM.
+                    **_llama_kwargs(share=replicas, mlock_var="EMBED_USE_MLOCK", mlock_default="0"),
+                )
+                _warm_up(model, embedding=True)
+                pool.put(model)
+            _embed_pool, _embed_replicas = pool, replicas
+            _embed_model_id = os.path.basename(path)
+            logger.info("Embedding model loaded.")
+            return
+
+    logger.warning("No embedding model found in %s", model_paths)
+
+def get_embedding(text: str) -> np.ndarray:
+    """Embed text as a float32 vector."""
+    key = _embed_key(text)
+    vec = _cache_get(key)
+    if vec is None:
+        vec = _embed_batch([text])[0]
+        _cache_put(key, vec)
+    return vec
 
-def get_embedding(text: str) -> list[float]:
-    """Embed text."""
-    mode = _embed_mode or _get_embed_mode()
-    if mode == "remote":
-        return _remote_embed(text)
-    return _local_embed(text)
+def get_embeddings(texts: list[str]) -> list[np.ndarray]:
+    """Embed many texts; cache misses go to the model in one batched call."""
+    keys = [_embed_key(t) for t in texts]
+    vecs = [_cache_get(k) for k in keys]
+    missing = {k: t for k, t, v in zip(keys, texts, vecs) if v is None}
+    if missing:
+        fresh = dict(zip(missing, _embed_batch(list(missing.values()))))
+        for k, vec in fresh.items():
+            _cache_put(k, vec)
+        vecs = [v if v is not None else fresh[k] for k, v in zip(keys, vecs)]
+    return vecs
 
-def _local_embed(text: str) -> list[float]:
-    if _embed_model is None:
+def _embed_batch(texts: list[str]) -> list[np.ndarray]:
+    if _config().embed_mode == "remote":
+        return _remote_embed(texts)
+    return _local_embed(texts)
+
+# nomic-embed task prefix; queries and stored items share one space.
+_EMBED_PREFIX = "search_query: "
+
+def _prefixed(texts: list[str]) -> list[str]:
+    prefix = _EMBED_PREFIX
+    return [prefix + t for t in texts]
+
+def _as_vector(values) -> np.ndarray:
+    vec = np.asarray(values, dtype=np.float32)
+    vec.flags.writeable = False
+    return vec
+
+def _local_embed(texts: list[str]) -> list[np.ndarray]:
+    if _embed_pool is None:
         raise RuntimeError("No local embedding model loaded.")
-    result = _embed_model.embed(f"search_query: {text}")
-    return result[0] if isinstance(result[0], list) else result
+    model = _embed_pool.get()
+    try:
+        results = model.embed(_prefixed(texts))
+    finally:
+        _embed_pool.put(model)
+    return [_as_vector(r) for r in results]
 
-def _remote_embed(text: str) -> list[float]:
-    api_url = os.getenv("EMBED_API_URL")
-    api_key = os.getenv("EMBED_API_KEY", "")
-    model_name = os.getenv("EMBED_MODEL_NAME", "nomic-embed-text")
+def _local_embed_untruncated(text: str) -> np.ndarray | None:
+    """Embed one text uncached, or return None if it exceeds the context."""
+    if _embed_pool is None:
+        raise RuntimeError("No local embedding model loaded.")
+    (text,) = _prefixed([text])
+    model = _embed_pool.get()
+    try:
+        if len(model.tokenize(text.encode())) > model.n_ctx():
+            return None
+        (result,) = model.embed([text])
+    finally:
+        _embed_pool.put(model)
+    return _as_vector(result)
 
-    if not api_url:
+def _remote_embed_request(texts: list[str]) -> tuple[str, dict, dict]:
+    """Build (url, headers, payload) for a remote /embeddings call."""
+    cfg = _config()
+    if not cfg.embed_api_url:
         raise RuntimeError("EMBED_API_URL not set.")
 
-    headers = {"Content-Type": "application/json"}
-    if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
+    payload = {"model": cfg.embed_model_name or "nomic-embed-text", "input": _prefixed(texts)}
+    return cfg.embed_url, cfg.embed_headers, payload
 
-    r = requests.post(
-        f"{api_url.rstrip('/')}/embeddings",
-        headers=headers,
-        json={"model": model_name, "input": f"search_query: {text}"},
-        timeout=30,
-    )
-    r.raise_for_status()
-    return r.json()["data"][0]["embedding"]
+def _parse_embeddings(body: dict) -> list[np.ndarray]:
+    data = sorted(body["data"], key=lambda d: d.get("index", 0))
+    return [_as_vector(d["embedding"]) for d in data]
+
+def _remote_embed(texts: list[str]) -> list[np.ndarray]:
+    url, headers, payload = _remote_embed_request(texts)
+    with _embed_breaker:
+        r = _session().post(url, headers=headers, data=orjson.dumps(payload), timeout=30)
+        r.raise_for_status()
+        return _parse_embeddings(orjson.loads(r.content))
+
+async def _remote_embed_async(texts: list[str]) -> list[np.ndarray]:
+    url, headers, payload = _remote_embed_request(texts)
+    with _embed_breaker:
+        r = await _apost(url, headers, orjson.dumps(payload), timeout=30)
+        r.raise_for_status()
+        return _parse_embeddings(orjson.loads(r.content))
+
+
+# ── Embedding Batcher ────────────────────────────────────────────────────────
+# Concurrent async callers are coalesced into one model call: llama.cpp (and
+# remote /embeddings endpoints) process a list of inputs for roughly the cost
+# of one, so requests that arrive together share a single pass.
+
+EMBED_BATCH_MAX = 32
+EMBED_BATCH_WAIT = 0.005  # seconds to wait for more callers once one arrives
+
+_embed_queue: asyncio.Queue | None = None
+_embed_loop: asyncio.AbstractEventLoop | None = None
+
+async def get_embedding_async(text: str) -> np.ndarray:
+    """Embed text without blocking the event loop, batching with concurrent callers."""
+    global _embed_queue, _embed_loop
+    key = _embed_key(text)
+    vec = _cache_get(key)
+    if vec is not None:
+        return vec
+    loop = asyncio.get_running_loop()
+    if _embed_queue is None or _embed_loop is not loop:
+        _embed_queue, _embed_loop = asyncio.Queue(), loop
+        loop.create_task(_embed_batcher(_embed_queue))
+    fut = loop.create_future()
+    await _embed_queue.put((text, key, fut))
+    return await fut
+
+async def get_embeddings_async(texts: list[str]) -> list[np.ndarray]:
+    """Embed many texts without blocking; they fill batches of up to
+    EMBED_BATCH_MAX, which run in parallel across the local replicas."""
+    return list(await asyncio.gather(*(get_embedding_async(t) for t in texts)))
+
+async def _embed_batcher(queue: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    # One batch in flight per local replica; remote batches share the pool.
+    # Sized from the configured count: the pool's qsize() drops while sync
+    # callers hold replicas, and is 0 when every one is borrowed.
+    slots = asyncio.Semaphore(_embed_replicas or 4)
+    running = set()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + EMBED_BATCH_WAIT
+        while len(batch) < EMBED_BATCH_MAX:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        await slots.acquire()
+        task = loop.create_task(_embed_run(batch, slots))
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+async def _embed_texts(texts: list[str]) -> list[np.ndarray]:
+    if _config().embed_mode == "remote":
+        return await _remote_embed_async(texts)
+    return await asyncio.to_thread(_local_embed, texts)
+
+async def _embed_run(batch: list, slots: asyncio.Semaphore):
+    try:
+        try:
+            results = await _embed_texts([t for t, _, _ in batch])
+        except Exception as e:
+            if len(batch) == 1 or isinstance(e, CircuitOpenError):
+                results = [e] * len(batch)
+            else:
+                # One bad input (e.g. too long for the endpoint) must not fail
+                # the callers it happened to be batched with: retry one by one.
+                results = []
+                for text, _, _ in batch:
+                    try:
+                        results.extend(await _embed_texts([text]))
+                    except Exception as item_error:
+                        results.append(item_error)
+    finally:
+        slots.release()
+    for (_, key, fut), result in zip(batch, results):
+        if isinstance(result, Exception):
+            if not fut.done():
+                fut.set_exception(result)
+            continue
+        _cache_put(key, result)
+        if not fut.done():
+            fut.set_result(result)
 
 def is_embedding_available() -> bool:
-    mode = _embed_mode or _get_embed_mode()
-    if mode == "remote":
-        return bool(os.getenv("EMBED_API_URL"))
-    return _embed_model is not None
+    if _config().embed_mode == "remote":
+        return bool(_config().embed_api_url)
+    return _embed_pool is not None
 
 def get_embed_model_name() -> str:
-    mode = _embed_mode or _get_embed_mode()
-    if mode == "remote":
-        return os.getenv("EMBED_MODEL_NAME", "remote")
-    if _embed_model is not None:
+    if _config().embed_mode == "remote":
+        return _config().embed_model_name or "remote"
+    if _embed_pool is not None:
         return "nomic-embed-text-local"
     return "none"
@@ -4,21 +4,23 @@ Clippy Backend — FastAPI server with Cognee + Qdrant + Local LLM.
 Lean, flat structure:
 - config.py: all settings
 - models.py: Pydantic models
-- models.py: Pydantic models
+- entities.py: regex entity extraction
 - ai.py: Unified AI services (LLM + Embeddings)
 """
 
 import asyncio
-import json
 import logging
 import os
-import re
-import subprocess
+import secrets
+import struct
 import sys
 import time
 import uuid
 from contextlib import asynccontextmanager
 
+import msgspec
+import orjson
+
 # ── Environment bootstrap (BEFORE library imports) ────────────────────────────
 os.environ.setdefault("GGML_LOG_LEVEL", "4")
 os.environ.setdefault("ENABLE_BACKEND_ACCESS_CONTROL", "false")
@@ -29,105 +31,223 @@ load_dotenv()
 
 os.environ.setdefault("VECTOR_DB_PROVIDER", "qdrant")
 os.environ.setdefault("VECTOR_DB_URL", os.getenv("QDRANT_URL", "http://localhost:6333"))
+os.environ.setdefault("VECTOR_DATASET_DATABASE_HANDLER", "qdrant")
 
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from qdrant_client import QdrantClient
+from fastapi.responses import JSONResponse, StreamingResponse
+from qdrant_client import AsyncQdrantClient
 from qdrant_client.models import (
     Distance, FieldCondition, Filter, MatchValue, PayloadSchemaType,
-    PointStruct, Prefetch, Fusion, FusionQuery, VectorParams,
-    DiscoverQuery, DiscoverInput, ContextPair,
+    Batch, VectorParams, HnswConfigDiff,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    SearchParams, QuantizationSearchParams, PayloadSelectorInclude,
+    DiscoverQuery, DiscoverInput, ContextPair, Prefetch,
     RecommendQuery, RecommendInput, RecommendStrategy,
 )
 
 from config import (
-    EMBED_MODEL_PATH, LLM_MODEL_PATH, LLM_FALLBACK_PATH,
-    QDRANT_URL, COLLECTION, VECTOR_DIM,
-    COGNEE_ADD_TIMEOUT, COGNEE_COGNIFY_TIMEOUT, COGNEE_SEARCH_TIMEOUT,
-    DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT, RAG_CONTEXT_LIMIT, RAG_MAX_TOKENS,
+    EMBED_MODEL_PATHS, LLM_MODEL_PATH, LLM_FALLBACK_PATH,
+    QDRANT_URL, QDRANT_GRPC_PORT, COLLECTION, VECTOR_DIM,
+    COGNEE_ADD_TIMEOUT, COGNEE_COGNIFY_TIMEOUT, COGNEE_SEARCH_TIMEOUT, COGNEE_ISOLATED,
+    DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT, RAG_CONTEXT_LIMIT, RAG_MAX_TOKENS, MAX_ADD_ITEMS,
+    BACKEND_PORT,
 )
 from models import (
     AddItemRequest, AddKnowledgeRequest, ExtractEntitiesRequest,
     ChatCompletionRequest, point_to_dict,
 )
 from ai import (
-    init_embeddings, get_embedding, is_embedding_available as embed_ok, get_embed_model_name as embed_name,
-    init_llm, get_llm_response, is_llm_available as llm_ok, get_llm_model_name as llm_name
+    init_embeddings, get_embedding_async, get_embeddings_async, is_embedding_available as embed_ok, get_embed_model_name as embed_name,
+    init_llm, get_llm_response_async, stream_llm_response_async, is_llm_available as llm_ok, get_llm_model_name as llm_name,
+    get_chat_response_async, stream_chat_response_async,
+    is_llm_error, close_http, clear_embedding_cache, clear_llm_cache, llm_cache_stats, prefetch_models, LRUCache,
 )
+from entities import extract_entities
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
 logger = logging.getLogger("clippy")
 
 # ── Clients ───────────────────────────────────────────────────────────────────
-qdrant = QdrantClient(url=QDRANT_URL)
+# gRPC: protobuf-encoded vectors over one persistent HTTP/2 channel. The
+# asyncio client keeps the event loop free during each Qdrant round trip.
+qdrant = AsyncQdrantClient(url=QDRANT_URL, prefer_grpc=True, grpc_port=QDRANT_GRPC_PORT, timeout=30)
 BASE_DIR = os.path.dirname(__file__)
 
+# /ask answers keyed by (question, limit, retrieved point ids): a repeat
+# question over the same context skips the LLM.
+_answer_cache = LRUCache(256)
+
 # ── Cognee (optional) ─────────────────────────────────────────────────────────
 try:
     import cognee
+    from cognee_worker import dispatch as cognee_dispatch
     COGNEE_OK = True
 except ImportError:
     COGNEE_OK = False
 
-# ── Entity Patterns ───────────────────────────────────────────────────────────
-ENTITY_PATTERNS = [
-    ("url", re.compile(r'https?://[^\s<>"{}|\\^`\[\]]+', re.I)),
-    ("email", re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')),
-    ("phone", re.compile(r'(?:\+\d{1,3}[-.\\s]?)?\(?\d{3}\)?[-.\\s]?\d{3}[-.\\s]?\d{4}')),
-    ("date", re.compile(r'\b\d{4}[-/]\d{1,2}[-/]\d{1,2}\b|\b\d{1,2}[-/]\d{1,2}[-/]\d{2,4}\b')),
-    ("money", re.compile(r'\$[\d,]+(?:\.\d{2})?', re.I)),
-    ("file_path", re.compile(r'(?:/[\w.-]+){2,}|[A-Z]:\\(?:[\w.-]+\\?)+')),
-]
-
-
-def extract_entities(text: str) -> list[dict]:
-    seen, out = set(), []
-    for etype, pat in ENTITY_PATTERNS:
-        for m in pat.finditer(text):
-            v = m.group().strip()
-            if (etype, v) not in seen:
-                seen.add((etype, v))
-                out.append({"type": etype, "value": v})
-    return out
-
-
-
-
-
-async def run_cognee_worker(payload: dict, timeout: int = 30) -> dict:
-    """Run cognee_worker.py subprocess."""
-    worker = os.path.join(BASE_DIR, "cognee_worker.py")
-    python = os.path.join(BASE_DIR, "venv", "bin", "python") if os.path.exists(os.path.join(BASE_DIR, "venv")) else sys.executable
-    proc = await asyncio.get_event_loop().run_in_executor(
-        None, lambda: subprocess.run([python, worker], input=json.dumps(payload), capture_output=True, text=True, timeout=timeout, cwd=BASE_DIR)
-    )
-    if proc.returncode != 0:
-        raise RuntimeError(f"Worker failed: {(proc.stderr or proc.stdout or '')[-300:]}")
-    result = json.loads(proc.stdout)
-    if not result.get("ok"):
-        raise RuntimeError(result.get("error", "unknown"))
-    return result
-
-
-def ensure_collection():
-    if COLLECTION not in [c.name for c in qdrant.get_collections().collections]:
-        qdrant.create_collection(COLLECTION, VectorParams(size=VECTOR_DIM, distance=Distance.COSINE))
+class CogneeWorker:
+    """One long-lived cognee_worker.py child speaking length-prefixed JSON frames over stdio.
+
+    Pays the interpreter + cognee import cost once instead of per request.
+    Frames are a 4-byte big-endian length followed by that many bytes of
+    JSON, so results of any size are read with two exact reads and no
+    delimiter scanning.
+    The worker runs one action at a time, so a request holds the lock for
+    its whole round trip: its timeout then covers only its own run, never
+    time spent queued behind someone else's cognify. Responses are matched
+    by request id against the pending map of the process that was sent the
+    request; a crashed or timed-out worker is killed and respawned on the
+    next request.
+    """
+
+    def __init__(self):
+        self._proc: asyncio.subprocess.Process | None = None
+        self._reader: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        self._pending: dict[str, asyncio.Future] = {}
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.returncode is None
+
+    async def start(self):
+        worker = os.path.join(BASE_DIR, "cognee_worker.py")
+        python = os.path.join(BASE_DIR, "venv", "bin", "python") if os.path.exists(os.path.join(BASE_DIR, "venv")) else sys.executable
+        self._proc = await asyncio.create_subprocess_exec(
+            python, worker, "--framed",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            cwd=BASE_DIR,
+        )
+        self._pending = {}
+        self._reader = asyncio.create_task(self._read_loop(self._proc, self._pending))
+        logger.info(f"Cognee worker started (PID {self._proc.pid})")
+
+    async def _read_loop(self, proc: asyncio.subprocess.Process, pending: dict[str, asyncio.Future]):
+        while True:
+            try:
+                (size,) = struct.unpack(">I", await proc.stdout.readexactly(4))
+                frame = await proc.stdout.readexactly(size)
+            except asyncio.IncompleteReadError:
+                break
+            try:
+                msg = orjson.loads(frame)
+            except ValueError:
+                continue
+            fut = pending.pop(msg.get("id"), None)
+            if fut is not None and not fut.done():
+                fut.set_result(msg)
+        # EOF — the worker exited; fail everything still waiting on it.
+        for fut in pending.values():
+            if not fut.done():
+                fut.set_exception(RuntimeError("Worker exited"))
+        pending.clear()
+
+    async def request(self, payload: dict, timeout: int) -> dict:
+        async with self._lock:
+            if not self.alive:
+                await self.start()
+            pending = self._pending
+            rid = uuid.uuid4().hex
+            fut = asyncio.get_running_loop().create_future()
+            pending[rid] = fut
+            body = orjson.dumps({**payload, "id": rid})
+            self._proc.stdin.write(struct.pack(">I", len(body)) + body)
+            await self._proc.stdin.drain()
+            try:
+                result = await asyncio.wait_for(fut, timeout)
+            except asyncio.TimeoutError:
+                pending.pop(rid, None)
+                # This request has the worker to itself, so it is the one
+                # that hung; it would block every later request.
+                await self.stop()
+                raise RuntimeError(f"Worker timed out after {timeout}s")
+        if not result.get("ok"):
+            raise RuntimeError(result.get("error", "unknown"))
+        return result
+
+    async def stop(self):
+        proc, self._proc = self._proc, None
+        if proc is None or proc.returncode is not None:
+            return
+        proc.stdin.close()
+        try:
+            await asyncio.wait_for(proc.wait(), 5)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+
+
+cognee_worker = CogneeWorker()
+
+# Cognee is not known to be re-entrant; in-process calls take turns, exactly
+# as they did when every call went through a single worker.
+_cognee_sem = asyncio.Semaphore(1)
+
+
+async def run_cognee(payload: dict, timeout: int = 30):
+    """Run one Cognee action and return its result.
+
+    In-process by default; with COGNEE_ISOLATED=1 the action goes to the
+    persistent cognee_worker.py child instead.
+    """
+    if COGNEE_ISOLATED:
+        return (await cognee_worker.request(payload, timeout))["result"]
+    async with _cognee_sem:
+        try:
+            return await asyncio.wait_for(cognee_dispatch(payload), timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"Cognee {payload.get('action')} timed out after {timeout}s")
+
+
+# int8 copy of every vector stays in RAM for the HNSW walk; the fp32 originals
+# live on disk and are only read to rescore the oversampled top-k.
+QUANTIZATION = ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+SEARCH_PARAMS = SearchParams(quantization=QuantizationSearchParams(rescore=True, oversampling=2.0))
+# A denser graph offsets the recall lost to int8. It is ~256 B/point against
+# 3 KB of fp32 vector, so it stays in RAM; payloads are only read for the
+# returned top-k and go to disk (the keyword indexes are kept in memory).
+HNSW_CONFIG = HnswConfigDiff(m=32, ef_construct=256)
+
+# Server-side payload projection: only ship the fields a response uses.
+DISPLAY_PAYLOAD = PayloadSelectorInclude(include=["content", "contentType", "appName", "title", "tags"])
+RAG_PAYLOAD = PayloadSelectorInclude(include=["content", "appName"])
+
+
+async def ensure_collection():
+    if not await qdrant.collection_exists(COLLECTION):
+        await qdrant.create_collection(
+            COLLECTION,
+            VectorParams(size=VECTOR_DIM, distance=Distance.COSINE, on_disk=True),
+            quantization_config=QUANTIZATION,
+            hnsw_config=HNSW_CONFIG,
+            on_disk_payload=True,
+        )
         logger.info(f"Created collection '{COLLECTION}'")
     for field, schema in [("contentType", PayloadSchemaType.KEYWORD), ("appName", PayloadSchemaType.KEYWORD), ("tags", PayloadSchemaType.KEYWORD)]:
         try:
-            qdrant.create_payload_index(COLLECTION, field, schema)
+            await qdrant.create_payload_index(COLLECTION, field, schema)
         except Exception:
             pass
 
 
 # ── Lifespan ──────────────────────────────────────────────────────────────────
+LLM_MODELS = [(LLM_MODEL_PATH, "Distil Labs"), (LLM_FALLBACK_PATH, "Qwen3-4B")]
+
+
+def _load_models():
+    # One thread, one model at a time (llama.cpp backend/GPU init is not meant
+    # to race), but both files are already being read ahead by then.
+    prefetch_models(EMBED_MODEL_PATHS, [p for p, _ in LLM_MODELS])
+    init_embeddings(EMBED_MODEL_PATHS)
+    init_llm(LLM_MODELS)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting Clippy Backend...")
-    init_embeddings(EMBED_MODEL_PATH)
-    init_llm([(LLM_MODEL_PATH, "Distil Labs"), (LLM_FALLBACK_PATH, "Qwen3-4B")])
-    ensure_collection()
+    # Model loading (disk/GPU bound) overlaps the Qdrant setup round trips.
+    await asyncio.gather(asyncio.to_thread(_load_models), ensure_collection())
     
     if COGNEE_OK:
         try:
@@ -150,14 +270,29 @@ async def lifespan(app: FastAPI):
             logger.info("Cognee initialized.")
         except Exception as e:
             logger.warning(f"Cognee init error: {e}")
+        if COGNEE_ISOLATED:
+            try:
+                await cognee_worker.start()
+            except Exception as e:
+                logger.warning(f"Cognee worker start error: {e}")
     
     logger.info("Ready.")
     yield
     logger.info("Shutting down.")
+    await cognee_worker.stop()
+    await close_http()
+    await qdrant.close()
 
 
 # ── App ───────────────────────────────────────────────────────────────────────
-app = FastAPI(title="Clippy Backend", version="2.0.0", lifespan=lifespan)
+class OrjsonResponse(JSONResponse):
+    """JSON rendered by orjson; FastAPI's own ORJSONResponse is deprecated."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+app = FastAPI(title="Clippy Backend", version="2.0.0", lifespan=lifespan, default_response_class=OrjsonResponse)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
 
@@ -165,7 +300,7 @@ app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True,
 @app.get("/health")
 async def health():
     try:
-        info = qdrant.get_collection(COLLECTION)
+        info = await qdrant.get_collection(COLLECTION)
         pts = info.points_count
         qok = True
     except Exception:
@@ -175,36 +310,52 @@ async def health():
         "services": {"embeddings": embed_ok(), "llm": llm_ok(), "qdrant": qok, "cognee": COGNEE_OK},
         "models": {"embed": embed_name(), "llm": llm_name()},
         "collection": {"name": COLLECTION, "points": pts},
+        "llm_cache": llm_cache_stats(),
     }
 
 
 # ── Search ────────────────────────────────────────────────────────────────────
+def _query_vector(q: str):
+    # Repeated dashboard queries differ only in case/whitespace; normalising
+    # them first lets the embedding LRU in ai.py serve the hit.
+    return get_embedding_async(q.strip().lower())
+
+
 @app.get("/search")
 async def search(q: str = Query(...), limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT)):
     t0 = time.time()
-    vec = get_embedding(q)
-    results = qdrant.query_points(COLLECTION, prefetch=[Prefetch(query=vec, limit=100), Prefetch(query=vec, limit=50)], query=FusionQuery(fusion=Fusion.RRF), limit=limit, with_payload=True)
+    vec = await _query_vector(q)
+    results = await qdrant.query_points(COLLECTION, query=vec, limit=limit, with_payload=DISPLAY_PAYLOAD, search_params=SEARCH_PARAMS)
     return {"query": q, "results": [point_to_dict(p) for p in results.points], "time_ms": round((time.time() - t0) * 1000, 1)}
 
 
 @app.get("/search/grouped")
 async def search_grouped(q: str = Query(...), group_by: str = Query("contentType"), limit: int = Query(DEFAULT_SEARCH_LIMIT)):
     t0 = time.time()
-    vec = get_embedding(q)
-    groups = qdrant.query_points_groups(COLLECTION, query=vec, group_by=group_by, limit=limit, group_size=5, with_payload=True)
+    vec = await _query_vector(q)
+    groups = await qdrant.query_points_groups(COLLECTION, query=vec, group_by=group_by, limit=limit, group_size=5, with_payload=DISPLAY_PAYLOAD)
     return {"query": q, "groups": {str(g.id): [point_to_dict(h) for h in g.hits] for g in groups.groups}, "time_ms": round((time.time() - t0) * 1000, 1)}
 
 
+# /discover reranks the q neighbourhood instead of walking the whole graph
+# with a discovery/recommend query: one call, HNSW only for the cheap stage.
+DISCOVER_CANDIDATES = 200
+
+
 @app.get("/discover")
 async def discover(q: str = Query(...), positive_id: str = Query(None), negative_id: str = Query(None), limit: int = Query(DEFAULT_SEARCH_LIMIT)):
     t0 = time.time()
-    vec = get_embedding(q)
+    vec = await _query_vector(q)
+    # Model fields take plain lists: pydantic walks an ndarray element by
+    # element, ~30x slower than one tolist().
+    target = vec.tolist()
+    candidates = Prefetch(query=target, limit=max(DISCOVER_CANDIDATES, limit), params=SEARCH_PARAMS)
     if positive_id and negative_id:
-        results = qdrant.query_points(COLLECTION, query=DiscoverQuery(discover=DiscoverInput(target=vec, context=[ContextPair(positive=positive_id, negative=negative_id)])), limit=limit, with_payload=True)
+        results = await qdrant.query_points(COLLECTION, prefetch=candidates, query=DiscoverQuery(discover=DiscoverInput(target=target, context=[ContextPair(positive=positive_id, negative=negative_id)])), limit=limit, with_payload=DISPLAY_PAYLOAD)
     elif positive_id:
-        results = qdrant.query_points(COLLECTION, query=RecommendQuery(recommend=RecommendInput(positive=[positive_id], strategy=RecommendStrategy.AVERAGE_VECTOR)), limit=limit, with_payload=True)
+        results = await qdrant.query_points(COLLECTION, prefetch=candidates, query=RecommendQuery(recommend=RecommendInput(positive=[positive_id], strategy=RecommendStrategy.AVERAGE_VECTOR)), limit=limit, with_payload=DISPLAY_PAYLOAD)
     else:
-        results = qdrant.query_points(COLLECTION, query=vec, limit=limit, with_payload=True)
+        results = await qdrant.query_points(COLLECTION, query=vec, limit=limit, with_payload=DISPLAY_PAYLOAD, search_params=SEARCH_PARAMS)
     return {"query": q, "results": [point_to_dict(p) for p in results.points], "time_ms": round((time.time() - t0) * 1000, 1)}
 
 
@@ -213,29 +364,41 @@ async def recommend(positive_ids: str = Query(...), negative_ids: str = Query(""
     t0 = time.time()
     pos = [p.strip() for p in positive_ids.split(",") if p.strip()]
     neg = [n.strip() for n in negative_ids.split(",") if n.strip()]
-    results = qdrant.query_points(COLLECTION, query=RecommendQuery(recommend=RecommendInput(positive=pos, negative=neg or None, strategy=RecommendStrategy.AVERAGE_VECTOR)), limit=limit, with_payload=True)
+    results = await qdrant.query_points(COLLECTION, query=RecommendQuery(recommend=RecommendInput(positive=pos, negative=neg or None, strategy=RecommendStrategy.AVERAGE_VECTOR)), limit=limit, with_payload=DISPLAY_PAYLOAD)
     return {"results": [point_to_dict(p) for p in results.points], "time_ms": round((time.time() - t0) * 1000, 1)}
 
 
 @app.get("/filter")
 async def filtered_search(q: str = Query(...), type_filter: str = Query(None), app_filter: str = Query(None), limit: int = Query(DEFAULT_SEARCH_LIMIT)):
     t0 = time.time()
-    vec = get_embedding(q)
+    vec = await _query_vector(q)
     conds = []
     if type_filter:
         conds.append(FieldCondition(key="contentType", match=MatchValue(value=type_filter)))
     if app_filter:
         conds.append(FieldCondition(key="appName", match=MatchValue(value=app_filter)))
-    results = qdrant.query_points(COLLECTION, query=vec, query_filter=Filter(must=conds) if conds else None, limit=limit, with_payload=True)
+    results = await qdrant.query_points(COLLECTION, query=vec, query_filter=Filter(must=conds) if conds else None, limit=limit, with_payload=DISPLAY_PAYLOAD)
     return {"results": [point_to_dict(p) for p in results.points], "time_ms": round((time.time() - t0) * 1000, 1)}
 
 
 # ── RAG ───────────────────────────────────────────────────────────────────────
+def _sse(data) -> bytes:
+    return b"data: " + orjson.dumps(data) + b"\n\n"
+
+
+_SSE_DONE = b"data: [DONE]\n\n"
+
+# Kept byte-identical across calls and placed first in the chat template, so
+# llama.cpp's prefix match finds its tokens already in the replica's KV cache
+# and only the context and question are prefilled.
+ASK_SYSTEM_PROMPT = "You are a helpful assistant. Use 'you/your' instead of 'I/my'. Answer using ONLY the context."
+
+
 @app.get("/ask")
-async def ask(q: str = Query(...), limit: int = Query(RAG_CONTEXT_LIMIT)):
+async def ask(q: str = Query(...), limit: int = Query(RAG_CONTEXT_LIMIT), stream: bool = Query(False)):
     t0 = time.time()
-    vec = get_embedding(q)
-    results = qdrant.query_points(COLLECTION, prefetch=[Prefetch(query=vec, limit=50)], query=FusionQuery(fusion=Fusion.RRF), limit=limit, with_payload=True)
+    vec = await _query_vector(q)
+    results = await qdrant.query_points(COLLECTION, query=vec, limit=limit, with_payload=RAG_PAYLOAD, search_params=SEARCH_PARAMS)
     
     docs = []
     for p in results.points:
@@ -243,50 +406,111 @@ async def ask(q: str = Query(...), limit: int = Query(RAG_CONTEXT_LIMIT)):
         prefix = f"[{pl.get('appName','')}] " if pl.get('appName') else ""
         docs.append(f"{prefix}{pl.get('content','')[:500]}")
     context = "\n---\n".join(docs)
+    user_prompt = f"Context:\n{context}\n\nQuestion: {q}"
     
-    try:
-        answer = get_llm_response(
-            "You are a helpful assistant. Use 'you/your' instead of 'I/my'. Answer using ONLY the context.",
-            f"Context:\n{context}\n\nQuestion: {q}", 
-            max_tokens=RAG_MAX_TOKENS
-        )
-    except Exception as e:
-        answer = f"LLM error: {e}"
+    cache_key = (q, limit, tuple(str(p.id) for p in results.points))
+    answer = _answer_cache.get(cache_key)
+
+    if stream:
+        async def events():
+            text = answer
+            if text is None:
+                parts = []
+                try:
+                    async for piece in stream_llm_response_async(ASK_SYSTEM_PROMPT, user_prompt, RAG_MAX_TOKENS):
+                        parts.append(piece)
+                        yield _sse({"delta": piece})
+                except Exception as e:
+                    yield _sse({"error": f"LLM error: {e}"})
+                    return
+                text = "".join(parts).strip()
+                if not is_llm_error(text):
+                    _answer_cache.put(cache_key, text)
+            else:
+                yield _sse({"delta": text})
+            yield _sse({"sources": len(docs), "time_ms": round((time.time() - t0) * 1000, 1), "model": llm_name()})
+            yield _SSE_DONE
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    if answer is None:
+        try:
+            answer = await get_llm_response_async(ASK_SYSTEM_PROMPT, user_prompt, max_tokens=RAG_MAX_TOKENS)
+            if not is_llm_error(answer):
+                _answer_cache.put(cache_key, answer)
+        except Exception as e:
+            answer = f"LLM error: {e}"
     
     return {"question": q, "answer": answer, "sources": len(docs), "time_ms": round((time.time() - t0) * 1000, 1), "model": llm_name()}
 
 
+_JSON_ONLY = "IMPORTANT: Respond with valid JSON only."
+_chat_decoder = msgspec.json.Decoder(ChatCompletionRequest)  # built once, reused per request
+_NO_USAGE = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}  # shared, never mutated
+
+
+def _chat_messages(request: ChatCompletionRequest) -> list[dict]:
+    # One leading system message, then the turns in order: each call's prompt
+    # then extends the previous one byte for byte, so the backend's KV/prefix
+    # cache covers everything but the newest turn.
+    system = "\n".join(m.content for m in request.messages if m.role in ("system", "developer")).strip()
+    if request.response_format and request.response_format.get("type") == "json_object" and _JSON_ONLY not in system:
+        system = f"{system}\n\n{_JSON_ONLY}".lstrip()
+    messages = [{"role": "system", "content": system}] if system else []
+    messages += [{"role": m.role, "content": m.content} for m in request.messages if m.role in ("user", "assistant")]
+    return messages
+
+
 @app.post("/v1/chat/completions")
-async def chat_completions(request: ChatCompletionRequest):
-    sys_prompt = "\n".join(m.content for m in request.messages if m.role == "system").strip()
-    user_prompt = "\n".join(m.content for m in request.messages if m.role in ("user", "assistant")).strip()
-    if request.response_format and request.response_format.get("type") == "json_object":
-        sys_prompt += "\n\nIMPORTANT: Respond with valid JSON only."
+async def chat_completions(raw: Request):
+    # Decoded by msgspec straight from the body bytes instead of via Pydantic
     try:
-        answer = get_llm_response(sys_prompt, user_prompt, max_tokens=request.max_tokens)
+        request = _chat_decoder.decode(await raw.body())
+    except msgspec.DecodeError as e:
+        return OrjsonResponse({"detail": str(e)}, status_code=422)
+    messages = _chat_messages(request)
+    completion_id = "chatcmpl-" + secrets.token_hex(6)  # same 12 hex chars, no UUID object
+    created = int(time.time())
+
+    if request.stream:
+        def chunk(delta: dict, finish_reason: str | None = None) -> bytes:
+            return _sse({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": request.model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            })
+
+        async def events():
+            yield chunk({"role": "assistant"})
+            try:
+                async for piece in stream_chat_response_async(messages, request.max_tokens):
+                    yield chunk({"content": piece})
+            except Exception as e:
+                yield _sse({"error": {"message": str(e)}})
+                return
+            yield chunk({}, "stop")
+            yield _SSE_DONE
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    try:
+        answer = await get_chat_response_async(messages, max_tokens=request.max_tokens)
     except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
-    return {
-        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        return OrjsonResponse({"error": str(e)}, status_code=500)
+    # Returned as a response object so FastAPI skips its jsonable_encoder walk
+    return OrjsonResponse({
+        "id": completion_id,
         "object": "chat.completion",
-        "created": int(time.time()),
+        "created": created,
         "model": request.model,
         "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
-        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
-    }
+        "usage": _NO_USAGE,
+    })
 
 
 # ── Items ─────────────────────────────────────────────────────────────────────
-@app.post("/add-item")
-async def add_item(request: AddItemRequest):
-    t0 = time.time()
-    try:
-        vec = get_embedding(request.content)
-    except Exception as e:
-        return {"error": f"Embedding failed: {e}"}
-    
-    pid = str(uuid.uuid4())
-    qdrant.upsert(COLLECTION, [PointStruct(id=pid, vector=vec, payload={
+def _item_payload(request: AddItemRequest, entities: list[dict]) -> dict:
+    return {
         "content": request.content,
         "appName": request.app_name or "Unknown",
         "contentType": request.content_type,
@@ -294,21 +518,121 @@ async def add_item(request: AddItemRequest):
         "title": request.title or "",
         "timestamp": time.time(),
         "isFavorite": request.is_favorite,
-        "entities": [e["value"] for e in extract_entities(request.content)],
-    })])
+        "entities": [e["value"] for e in entities],
+    }
+
+
+# Bursts of single /add-item calls (clipboard activity) are coalesced into one
+# Qdrant upsert, the same way ai.py batches their embeddings.
+UPSERT_BATCH_MAX = 32
+UPSERT_BATCH_WAIT = 0.005  # seconds to wait for more points once one arrives
+
+_upsert_queue: asyncio.Queue | None = None
+_upsert_loop: asyncio.AbstractEventLoop | None = None
+
+
+async def _upsert_point(pid: str, vector: list[float], payload: dict):
+    """Queue one point for the next batched upsert and wait until it is sent."""
+    global _upsert_queue, _upsert_loop
+    loop = asyncio.get_running_loop()
+    if _upsert_queue is None or _upsert_loop is not loop:
+        _upsert_queue, _upsert_loop = asyncio.Queue(), loop
+        loop.create_task(_upsert_batcher(_upsert_queue))
+    fut = loop.create_future()
+    await _upsert_queue.put(((pid, vector, payload), fut))
+    await fut
+
+
+async def _upsert_batcher(queue: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + UPSERT_BATCH_WAIT
+        while len(batch) < UPSERT_BATCH_MAX:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            # wait=False: acknowledged once Qdrant has the write, not after indexing
+            ids, vectors, payloads = zip(*(p for p, _ in batch))
+            await qdrant.upsert(COLLECTION, Batch(ids=ids, vectors=vectors, payloads=payloads), wait=False)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            continue
+        for _, fut in batch:
+            if not fut.done():
+                fut.set_result(None)
+
+
+def _extract_all(texts: list[str]) -> list[list[dict]]:
+    return [extract_entities(t) for t in texts]
+
+
+@app.post("/add-item")
+async def add_item(request: AddItemRequest):
+    t0 = time.time()
+    # Entity extraction runs in a worker thread alongside the embedding, so a
+    # large paste never holds the event loop for its regex scan.
+    entities = asyncio.ensure_future(asyncio.to_thread(extract_entities, request.content))
+    try:
+        vec = await get_embedding_async(request.content)
+    except Exception as e:
+        entities.cancel()  # nobody will await it; drop its result (and any error)
+        return {"error": f"Embedding failed: {e}"}
+
+    pid = str(uuid.uuid4())
+    await _upsert_point(pid, vec.tolist(), _item_payload(request, await entities))
     return {"status": "ok", "point_id": pid, "time_ms": round((time.time() - t0) * 1000, 1)}
 
 
+@app.post("/add-items")
+async def add_items(requests: list[AddItemRequest]):
+    t0 = time.time()
+    if len(requests) > MAX_ADD_ITEMS:
+        return {"error": f"Too many items: {len(requests)} (max {MAX_ADD_ITEMS} per request)"}
+    texts = [r.content for r in requests]
+    entities = asyncio.ensure_future(asyncio.to_thread(_extract_all, texts))
+    try:
+        vecs = await get_embeddings_async(texts)
+    except Exception as e:
+        entities.cancel()  # nobody will await it; drop its result (and any error)
+        return {"error": f"Embedding failed: {e}"}
+
+    pids = [str(uuid.uuid4()) for _ in requests]
+    payloads = [_item_payload(r, ents) for r, ents in zip(requests, await entities)]
+    # Through the upsert batcher: UPSERT_BATCH_MAX-point requests, shared
+    # with concurrent /add-item traffic, instead of one oversized upsert.
+    await asyncio.gather(*(_upsert_point(pid, v.tolist(), p) for pid, v, p in zip(pids, vecs, payloads)))
+    return {"status": "ok", "point_ids": pids, "time_ms": round((time.time() - t0) * 1000, 1)}
+
+
 @app.post("/extract-entities")
 async def extract_entities_endpoint(request: ExtractEntitiesRequest):
-    entities = extract_entities(request.content)
+    entities = await asyncio.to_thread(extract_entities, request.content)
     return {"entities": entities, "total": len(entities)}
 
 
+@app.post("/cache/clear")
+async def clear_cache():
+    clear_embedding_cache()
+    clear_llm_cache()
+    _answer_cache.clear()
+    return {"status": "ok"}
+
+
 @app.get("/collections")
 async def list_collections():
     try:
-        return {c.name: {"points": qdrant.get_collection(c.name).points_count} for c in qdrant.get_collections().collections}
+        names = [c.name for c in (await qdrant.get_collections()).collections]
+        infos = await asyncio.gather(*(qdrant.get_collection(n) for n in names))
+        return {n: {"points": info.points_count} for n, info in zip(names, infos)}
     except Exception as e:
         return {"error": str(e)}
 
@@ -320,8 +644,8 @@ async def cognee_search(q: str = Query(...), search_type: str = Query("CHUNKS"))
         return {"error": "Cognee not installed"}
     t0 = time.time()
     try:
-        result = await run_cognee_worker({"action": "search", "query": q, "search_type": search_type}, COGNEE_SEARCH_TIMEOUT)
-        return {"query": q, "results": result["result"], "time_ms": round((time.time() - t0) * 1000, 1)}
+        results = await run_cognee({"action": "search", "query": q, "search_type": search_type}, COGNEE_SEARCH_TIMEOUT)
+        return {"query": q, "results": results, "time_ms": round((time.time() - t0) * 1000, 1)}
     except Exception as e:
         return {"error": str(e), "time_ms": round((time.time() - t0) * 1000, 1)}
 
@@ -332,8 +656,8 @@ async def add_knowledge(request: AddKnowledgeRequest):
         return {"error": "Cognee not installed"}
     t0 = time.time()
     try:
-        await run_cognee_worker({"action": "add", "text": request.text}, COGNEE_ADD_TIMEOUT)
-        await run_cognee_worker({"action": "cognify"}, COGNEE_COGNIFY_TIMEOUT)
+        await run_cognee({"action": "add", "text": request.text}, COGNEE_ADD_TIMEOUT)
+        await run_cognee({"action": "cognify"}, COGNEE_COGNIFY_TIMEOUT)
         return {"status": "ok", "time_ms": round((time.time() - t0) * 1000, 1)}
     except Exception as e:
         return {"error": str(e), "time_ms": round((time.time() - t0) * 1000, 1)}
@@ -342,4 +666,18 @@ async def add_knowledge(request: AddKnowledgeRequest):
 # ── Main ──────────────────────────────────────────────────────────────────────
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app:app", host="127.0.0.1", port=8420, workers=1, reload=True)
+    # A dedicated switch: ENV is also read (and set) by cognee itself.
+    if os.getenv("BACKEND_RELOAD") == "1":
+        uvicorn.run("app:app", host="127.0.0.1", port=BACKEND_PORT, reload=True, reload_excludes=["*.gguf", ".cognee_data/*"])
+    else:
+        # Every worker loads its own models and KV caches, so extra workers
+        # only pay off when the LLM and embedder are remote.
+        local = "local" in (os.getenv("LLM_MODE", "local"), os.getenv("EMBED_MODE", "local"))
+        workers = int(os.getenv("WORKERS", "1" if local else "4"))
+        # Cognee's store under .cognee_data and the one-at-a-time guard around
+        # it are per process, in-process or isolated alike.
+        if COGNEE_OK and workers > 1:
+            logger.warning(f"WORKERS={workers} ignored: Cognee needs a single server process")
+            workers = 1
+        # uvloop/httptools are picked up automatically when installed
+        uvicorn.run("app:app", host="127.0.0.1", port=BACKEND_PORT, workers=workers, access_log=False)
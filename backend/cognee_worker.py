@@ -2,6 +2,9 @@
 """
 Cognee Worker — runs Cognee operations in an isolated subprocess.
 
+The backend calls dispatch() in-process by default; this process is used
+only with COGNEE_ISOLATED=1, or by hand as a debugging CLI.
+
 Bypasses two deadlocks in Cognee v0.5.2:
   1. send_telemetry() uses blocking requests.post() with no timeout
   2. setup_and_check_environment() calls test_llm_connection() /
@@ -14,56 +17,69 @@ Strategy: set _first_run_done = True on the correct module so that
           We still get table creation (create_relational_db_and_tables,
           create_pgvector_db_and_tables) which are either needed or no-ops.
 
-Usage (pipe JSON on stdin, get JSON on stdout):
+Protocol: newline-delimited JSON by default. With --framed (how the backend
+runs it), each message is instead a 4-byte big-endian length followed by the
+JSON bytes. Each request may carry an "id" which is echoed back on its
+response, so one long-lived worker can serve the backend for its whole
+lifetime (see CogneeWorker in app.py).
+
+Usage (pipe JSON lines on stdin, get JSON lines on stdout):
     echo '{"action":"add","text":"hello"}' | python cognee_worker.py
     echo '{"action":"cognify"}' | python cognee_worker.py
     echo '{"action":"search","query":"hello","search_type":"CHUNKS"}' | python cognee_worker.py
     echo '{"action":"prune"}' | python cognee_worker.py
 """
 
-import json
+import asyncio
 import os
+import struct
 import sys
 
-# ── Env vars BEFORE any imports ──────────────────────────────────────────────
-os.environ.setdefault("GGML_LOG_LEVEL", "4")  # errors only — suppress Metal bf16 noise
-os.environ.setdefault("ENABLE_BACKEND_ACCESS_CONTROL", "false")
-os.environ.setdefault("TELEMETRY_DISABLED", "1")
-os.environ.setdefault("ENV", "dev")
+import orjson
 
-from dotenv import load_dotenv
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
 
-os.environ.setdefault("VECTOR_DB_PROVIDER", "qdrant")
-os.environ.setdefault("VECTOR_DB_URL", os.getenv("QDRANT_URL", "http://localhost:6333"))
-os.environ.setdefault("VECTOR_DATASET_DATABASE_HANDLER", "qdrant")
+def _bootstrap():
+    """Standalone-process setup. Must run before cognee is first imported.
 
-import asyncio  # noqa: E402
+    Kept out of module scope so the backend can import dispatch() without
+    this module touching its environment.
+    """
+    os.environ.setdefault("GGML_LOG_LEVEL", "4")  # errors only — suppress Metal bf16 noise
+    os.environ.setdefault("ENABLE_BACKEND_ACCESS_CONTROL", "false")
+    os.environ.setdefault("TELEMETRY_DISABLED", "1")
+    os.environ.setdefault("ENV", "dev")
 
-# Register the Qdrant community adapter (side-effect import)
-try:
-    import cognee_community_vector_adapter_qdrant.register  # noqa: F401
-except ImportError:
-    pass
+    from dotenv import load_dotenv
 
-# ── Monkey-patch: skip test_llm_connection / test_embedding_connection ───────
-# The flag lives in cognee.modules.pipelines.layers.setup_and_check_environment
-# (NOT in cognee.modules.pipelines.operations.pipeline — that was the wrong module).
-try:
-    import cognee.modules.pipelines.layers.setup_and_check_environment as _env_check_mod
+    load_dotenv(os.path.join(BASE_DIR, ".env"))
 
-    _env_check_mod._first_run_done = True
-except Exception:
-    pass
+    os.environ.setdefault("VECTOR_DB_PROVIDER", "qdrant")
+    os.environ.setdefault("VECTOR_DB_URL", os.getenv("QDRANT_URL", "http://localhost:6333"))
+    os.environ.setdefault("VECTOR_DATASET_DATABASE_HANDLER", "qdrant")
 
-import cognee  # noqa: E402
+    # Register the Qdrant community adapter (side-effect import)
+    try:
+        import cognee_community_vector_adapter_qdrant.register  # noqa: F401
+    except ImportError:
+        pass
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    # ── Monkey-patch: skip test_llm_connection / test_embedding_connection ───
+    # The flag lives in cognee.modules.pipelines.layers.setup_and_check_environment
+    # (NOT in cognee.modules.pipelines.operations.pipeline — that was the wrong module).
+    try:
+        import cognee.modules.pipelines.layers.setup_and_check_environment as _env_check_mod
+
+        _env_check_mod._first_run_done = True
+    except Exception:
+        pass
 
 
 def _configure_cognee():
     """Set Cognee runtime config: Qdrant backend + project-level data dir."""
+    import cognee
+
     cognee_data_dir = os.path.join(BASE_DIR, ".cognee_data")
     os.makedirs(cognee_data_dir, exist_ok=True)
     cognee.config.data_root_directory(cognee_data_dir)
@@ -86,18 +102,23 @@ def _configure_cognee():
 
 async def do_add(text: str, dataset_name: str = "main_dataset") -> dict:
     """Add text to Cognee."""
+    import cognee
+
     await cognee.add(text, dataset_name=dataset_name)
     return {"status": "ok"}
 
 
 async def do_cognify() -> dict:
     """Run Cognee's cognify pipeline (LLM-based knowledge graph extraction)."""
+    import cognee
+
     await cognee.cognify()
     return {"status": "ok"}
 
 
 async def do_search(query: str, search_type: str = "CHUNKS") -> list:
     """Search Cognee knowledge graph."""
+    import cognee
     from cognee.api.v1.search import SearchType
 
     st = getattr(SearchType, search_type.upper(), SearchType.CHUNKS)
@@ -107,6 +128,8 @@ async def do_search(query: str, search_type: str = "CHUNKS") -> list:
 
 async def do_prune() -> dict:
     """Reset all Cognee data."""
+    import cognee
+
     await cognee.prune.prune_data()
     await cognee.prune.prune_system(metadata=True)
     return {"pruned": True}
@@ -114,43 +137,69 @@ async def do_prune() -> dict:
 
 # ── Main ─────────────────────────────────────────────────────────────────────
 
-def main():
-    _configure_cognee()
+async def dispatch(cmd: dict):
+    """Run a single action and return its result."""
+    action = cmd.get("action", "")
+    if action == "add":
+        return await do_add(cmd.get("text", ""), cmd.get("dataset_name", "main_dataset"))
+    if action == "cognify":
+        return await do_cognify()
+    if action == "search":
+        return await do_search(cmd.get("query", ""), cmd.get("search_type", "CHUNKS"))
+    if action == "prune":
+        return await do_prune()
+    if action == "ping":
+        return {"pong": True}
+    raise ValueError(f"Unknown action: {action}")
 
-    raw = sys.stdin.read().strip()
-    if not raw:
-        print(json.dumps({"ok": False, "error": "No input"}))
-        sys.exit(1)
 
-    try:
-        cmd = json.loads(raw)
-    except json.JSONDecodeError as e:
-        print(json.dumps({"ok": False, "error": f"Invalid JSON: {e}"}))
-        sys.exit(1)
+def _read_lines(stream):
+    for line in stream:
+        if raw := line.strip():
+            yield raw
 
-    action = cmd.get("action", "")
 
-    try:
-        if action == "add":
-            result = asyncio.run(
-                do_add(cmd.get("text", ""), cmd.get("dataset_name", "main_dataset"))
-            )
-        elif action == "cognify":
-            result = asyncio.run(do_cognify())
-        elif action == "search":
-            result = asyncio.run(
-                do_search(cmd.get("query", ""), cmd.get("search_type", "CHUNKS"))
-            )
-        elif action == "prune":
-            result = asyncio.run(do_prune())
-        else:
-            print(json.dumps({"ok": False, "error": f"Unknown action: {action}"}))
-            sys.exit(1)
-
-        print(json.dumps({"ok": True, "result": result}))
-    except Exception as e:
-        print(json.dumps({"ok": False, "error": str(e)}))
-        sys.exit(1)
+def _read_frames(stream):
+    while len(header := stream.read(4)) == 4:
+        (size,) = struct.unpack(">I", header)
+        yield stream.read(size)
+
+
+def main():
+    _bootstrap()
+    _configure_cognee()
+    framed = "--framed" in sys.argv[1:]
+
+    # Responses go to the real stdout; anything Cognee prints goes to stderr
+    # so it can never corrupt the protocol.
+    out = sys.stdout.buffer
+    sys.stdout = sys.stderr
+
+    def reply(msg: dict):
+        body = orjson.dumps(msg)
+        out.write(struct.pack(">I", len(body)) + body if framed else body + b"\n")
+        out.flush()
+
+    # One event loop for the lifetime of the process — Cognee's engines and
+    # clients stay warm between requests.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    for raw in (_read_frames if framed else _read_lines)(sys.stdin.buffer):
+        try:
+            cmd = orjson.loads(raw)
+        except orjson.JSONDecodeError as e:
+            reply({"ok": False, "error": f"Invalid JSON: {e}"})
+            continue
+
+        rid = cmd.get("id")
+        try:
+            result = loop.run_until_complete(dispatch(cmd))
+            reply({"id": rid, "ok": True, "result": result})
+        except Exception as e:
+            reply({"id": rid, "ok": False, "error": str(e)})
+
+    loop.close()
 
 
 if __name__ == "__main__":
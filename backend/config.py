@@ -8,18 +8,33 @@ import os
 BASE_DIR = os.path.dirname(__file__)
 MODELS_DIR = os.path.join(BASE_DIR, "..", "models")
 
-EMBED_MODEL_PATH = os.path.join(MODELS_DIR, "nomic-embed-text", "nomic-embed-text-v1.5.f16.gguf")
+# Embedding GGUFs in order of preference. Q5_K_M keeps retrieval quality close
+# to f16 at ~100 MB instead of ~260 MB and runs on the faster k-quant kernels;
+# Q4_K_M trades a little more quality for speed, f16 is the last resort.
+# EMBED_QUANT is tried first (e.g. f16 for regression runs, or a locally
+# quantized Q8_0), then these; run.sh picks the file the same way.
+EMBED_QUANTS = ("Q5_K_M", "Q4_K_M", "f16")
+EMBED_MODEL_DIR = os.path.join(MODELS_DIR, "nomic-embed-text")
+EMBED_MODEL_PATHS = [
+    os.path.join(EMBED_MODEL_DIR, f"nomic-embed-text-v1.5.{quant}.gguf")
+    for quant in dict.fromkeys(filter(None, (os.getenv("EMBED_QUANT"), *EMBED_QUANTS)))
+]
 LLM_MODEL_PATH = os.path.join(MODELS_DIR, "cognee-distillabs-model-gguf-quantized", "model-quantized.gguf")
 LLM_FALLBACK_PATH = os.path.join(MODELS_DIR, "Qwen3-4B-Q4_K_M", "Qwen3-4B-Q4_K_M.gguf")
 
 # Qdrant
 QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
 COLLECTION = "clippy_items"
 VECTOR_DIM = 768
 
 # Server
 BACKEND_PORT = 8420
 
+# Cognee runs in-process; set COGNEE_ISOLATED=1 to route it through the
+# persistent cognee_worker.py child instead (e.g. if a Cognee call deadlocks).
+COGNEE_ISOLATED = os.getenv("COGNEE_ISOLATED", "0") == "1"
+
 # Timeouts (seconds)
 COGNEE_ADD_TIMEOUT = 60
 COGNEE_COGNIFY_TIMEOUT = 180
@@ -30,3 +45,4 @@ DEFAULT_SEARCH_LIMIT = 20
 MAX_SEARCH_LIMIT = 100
 RAG_CONTEXT_LIMIT = 5
 RAG_MAX_TOKENS = 80
+MAX_ADD_ITEMS = 500  # items per /add-items request
@@ -0,0 +1,92 @@
+"""
+Entity extraction: URLs, emails, phones, dates, money and file paths.
+
+Runs on every /add-item, so the pattern work happens in compiled code:
+Hyperscan (when installed) or a substring prefilter picks the pattern types
+present, then one merged `re` alternation finds them all in a single pass.
+"""
+
+import functools
+import re
+import threading
+
+# ── Entity Patterns ───────────────────────────────────────────────────────────
+# (type, pattern, needles) — every match contains at least one of `needles`,
+# so a pattern none of whose needles occur in the text is skipped outright.
+# `needle in text` is a memchr-backed scan in C, far cheaper than a regex pass.
+_DIGITS = tuple("0123456789")
+ENTITY_PATTERNS = [
+    ("url", re.compile(r'https?://[^\s<>"{}|\\^`\[\]]+', re.I), ("://",)),
+    ("email", re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'), ("@",)),
+    ("phone", re.compile(r'(?:\+\d{1,3}[-.\\s]?)?\(?\d{3}\)?[-.\\s]?\d{3}[-.\\s]?\d{4}'), _DIGITS),
+    ("date", re.compile(r'\b\d{4}[-/]\d{1,2}[-/]\d{1,2}\b|\b\d{1,2}[-/]\d{1,2}[-/]\d{2,4}\b'), _DIGITS),
+    ("money", re.compile(r'\$[\d,]+(?:\.\d{2})?', re.I), ("$",)),
+    ("file_path", re.compile(r'(?:/[\w.-]+){2,}|[A-Z]:\\(?:[\w.-]+\\?)+'), ("/", "\\")),
+]
+
+
+# Optional: Hyperscan compiles all patterns into one SIMD-accelerated automaton
+# that tells us, in a single pass, which entity types occur in the text at all.
+try:
+    import hyperscan
+    _HS_DB = hyperscan.Database()
+    _HS_DB.compile(
+        expressions=[pat.pattern.encode() for _, pat, _ in ENTITY_PATTERNS],
+        ids=list(range(len(ENTITY_PATTERNS))),
+        flags=[
+            hyperscan.HS_FLAG_SINGLEMATCH
+            | (hyperscan.HS_FLAG_CASELESS if pat.flags & re.I else 0)
+            for _, pat, _ in ENTITY_PATTERNS
+        ],
+    )
+except Exception:
+    _HS_DB = None
+
+# A Hyperscan scratch space may only be used by one scan at a time, and
+# extraction runs in worker threads, so each thread allocates its own.
+_hs_local = threading.local()
+
+
+def _hs_scratch():
+    scratch = getattr(_hs_local, "scratch", None)
+    if scratch is None:
+        scratch = _hs_local.scratch = hyperscan.Scratch(_HS_DB)
+    return scratch
+
+
+def _active_patterns(text: str) -> tuple[int, ...]:
+    """Indices of the ENTITY_PATTERNS that can match somewhere in text."""
+    # Hyperscan's \w/\b are ASCII-only; str.isascii() is O(1), so non-ASCII
+    # text takes the substring prefilter and keeps Unicode semantics.
+    if _HS_DB is not None and text.isascii():
+        ids = set()
+        _HS_DB.scan(text.encode(), match_event_handler=lambda eid, frm, to, flags, ctx: ids.add(eid), scratch=_hs_scratch())
+        return tuple(sorted(ids))
+    return tuple(i for i, (_, _, needles) in enumerate(ENTITY_PATTERNS) if any(n in text for n in needles))
+
+
+@functools.lru_cache(maxsize=64)
+def _merged_pattern(indices: tuple[int, ...]) -> re.Pattern:
+    """One alternation of named groups over the given ENTITY_PATTERNS entries."""
+    parts = []
+    for i in indices:
+        etype, pat, _ = ENTITY_PATTERNS[i]
+        body = f"(?i:{pat.pattern})" if pat.flags & re.I else pat.pattern
+        parts.append(f"(?P<{etype}>{body})")
+    return re.compile("|".join(parts))
+
+
+def _scan_entities(text: str):
+    # Patterns that match nowhere can never win the alternation, so leaving
+    # them out of the merged regex does not change its result.
+    active = _active_patterns(text)
+    if not active:
+        return
+    for m in _merged_pattern(active).finditer(text):
+        yield m.lastgroup, m.group()
+
+
+def extract_entities(text: str) -> list[dict]:
+    # dict.fromkeys dedups in C while keeping first-seen order
+    found = dict.fromkeys((etype, v.strip()) for etype, v in _scan_entities(text))
+    return [{"type": etype, "value": v} for etype, v in found]
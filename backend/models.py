@@ -1,7 +1,14 @@
 """
-Clippy Backend Models — all Pydantic models in one place.
+Clippy Backend Models — all request models in one place.
+
+Pydantic for the small form-like endpoints; msgspec for the OpenAI-compatible
+chat body, which can carry long message histories and is decoded + validated
+in one C pass.
 """
 
+from typing import Literal
+
+import msgspec
 from pydantic import BaseModel
 
 
@@ -24,13 +31,16 @@ class ExtractEntitiesRequest(BaseModel):
     content: str
 
 
-class ChatMessage(BaseModel):
-    role: str
+# Unknown fields (name, tool_calls, ...) are ignored, like extra="allow" did.
+# Frozen: decoded once per request and only read afterwards.
+class ChatMessage(msgspec.Struct, frozen=True):
+    # "developer" is OpenAI's newer name for "system" and is merged into it;
+    # "tool" turns from replayed tool history are accepted and skipped.
+    role: Literal["system", "developer", "user", "assistant", "tool"]
     content: str = ""
-    model_config = {"extra": "allow"}
 
 
-class ChatCompletionRequest(BaseModel):
+class ChatCompletionRequest(msgspec.Struct, kw_only=True, frozen=True):
     model: str = "distil-labs-slm"
     messages: list[ChatMessage]
     max_tokens: int = 2048
@@ -40,14 +50,15 @@ class ChatCompletionRequest(BaseModel):
     n: int | None = None
     stop: list[str] | str | None = None
     stream: bool = False
-    model_config = {"extra": "allow"}
 
 
 # ─── Response Helpers ─────────────────────────────────────────────────────────
 
+_NO_PAYLOAD: dict = {}  # shared stand-in for points fetched without payload
+
 def point_to_dict(point) -> dict:
     """Convert a Qdrant ScoredPoint to a JSON-serializable dict."""
-    payload = point.payload or {}
+    payload = point.payload or _NO_PAYLOAD
     return {
         "id": str(point.id),
         "score": point.score,
@@ -109,7 +109,7 @@ download_models() {
     }
 
     log "1/3: nomic-embed-text (embedding model)"
-    download_hf_file "nomic-ai/nomic-embed-text-v1.5-GGUF" "nomic-embed-text-v1.5.f16.gguf" "$MODELS_DIR/nomic-embed-text"
+    download_hf_file "nomic-ai/nomic-embed-text-v1.5-GGUF" "nomic-embed-text-v1.5.Q5_K_M.gguf" "$MODELS_DIR/nomic-embed-text"
 
     log "2/3: Distil Labs SLM (primary LLM)"
     download_hf_file "distillabs/cognee-distillabs-gguf-quantized" "model-quantized.gguf" "$MODELS_DIR/cognee-distillabs-model-gguf-quantized"
@@ -240,7 +240,15 @@ else
 fi
 
 # ── 3. Model files (auto-download if missing) ─────────────────────────────
-EMBED_MODEL="$MODELS_DIR/nomic-embed-text/nomic-embed-text-v1.5.f16.gguf"
+# Embedding model: first quantization present wins (matches backend/config.py)
+EMBED_MODEL="$MODELS_DIR/nomic-embed-text/nomic-embed-text-v1.5.Q5_K_M.gguf"
+for quant in ${EMBED_QUANT:-} Q5_K_M Q4_K_M f16; do
+    candidate="$MODELS_DIR/nomic-embed-text/nomic-embed-text-v1.5.$quant.gguf"
+    [ -f "$candidate" ] && EMBED_MODEL="$candidate" && break
+done
+if [ -n "${EMBED_QUANT:-}" ] && [ "$EMBED_MODEL" != "$MODELS_DIR/nomic-embed-text/nomic-embed-text-v1.5.$EMBED_QUANT.gguf" ]; then
+    warn "EMBED_QUANT=$EMBED_QUANT: no nomic-embed-text-v1.5.$EMBED_QUANT.gguf, using $(basename "$EMBED_MODEL")"
+fi
 LLM_MODEL="$MODELS_DIR/cognee-distillabs-model-gguf-quantized/model-quantized.gguf"
 LLM_FALLBACK="$MODELS_DIR/Qwen3-4B-Q4_K_M/Qwen3-4B-Q4_K_M.gguf"
 
@@ -372,7 +380,7 @@ def test(method, path, body=None, label='', timeout=30):
 test('GET',  '/health', label='Health check')
 test('GET',  '/collections', label='Qdrant collections')
 test('POST', '/add-item', {'content':'Test item','content_type':'text','app_name':'Test'}, 'Add item (embed+Qdrant)')
-test('GET',  '/search?q=test&limit=2', label='Search (RRF Fusion)')
+test('GET',  '/search?q=test&limit=2', label='Search (dense)')
 test('GET',  '/search/grouped?q=test&group_by=appName&limit=2', label='Grouped search')
 test('GET',  '/filter?q=test&type_filter=text&limit=2', label='Filtered search')
 test('GET',  '/ask?q=What+is+a+test%3F&limit=2', label='RAG (Distil Labs SLM)')